@@ -0,0 +1,80 @@
+import socket
+import struct
+import threading
+import time
+
+from g_python.gextension import Extension, IncomingMessages, OutgoingMessages
+from g_python.gstream import FrameReader
+from g_python.hdirection import Direction
+from g_python.hpacket import HPacket
+
+BATCHES = 50
+BATCH_SIZE = 200
+LISTENED_HEADER = 1000
+
+
+def frame(header_id: int, payload: bytes = b'') -> bytes:
+    return struct.pack('>ih', len(payload) + 2, header_id) + payload
+
+
+def intercept_frame(index: int, packet: HPacket) -> bytes:
+    body = '0\t{}\tTOSERVER\t0'.format(index).encode('iso-8859-1') + bytes(packet.bytearray)
+    return frame(IncomingMessages.PACKET_INTERCEPT.value, struct.pack('>I', len(body)) + body)
+
+
+def mixed_batch(start: int, size: int) -> bytes:
+    # a crowded room: every third packet has a listener, the others pass through untouched
+    return b''.join(intercept_frame(i, HPacket(LISTENED_HEADER if i % 3 == 0 else 2000 + i % 7, 'text', i))
+                    for i in range(start, start + size))
+
+
+def message_index(response: HPacket) -> int:
+    # blocked, index, direction, ... separated by tabs
+    return int(bytes(response.buffer()[10:]).split(b'\t', 2)[1])
+
+
+def on_chat(message) -> None:
+    message.packet.read('si')
+
+
+def run(extension: Extension, reader: FrameReader, gearth: socket.socket, name: str, batch_size: int) -> None:
+    intercepted, bypassed = extension.intercepted_packets(), extension.bypassed_packets()
+    start = time.perf_counter()
+    for batch in range(BATCHES * BATCH_SIZE // batch_size):
+        gearth.sendall(mixed_batch(batch * batch_size, batch_size))
+        answered = []
+        while len(answered) < batch_size:
+            answered.extend(message_index(packet) for packet in reader.read_packets()
+                            if packet.header_id() == OutgoingMessages.MANIPULATED_PACKET)
+        # G-Earth gets the responses in the order it intercepted the packets
+        assert answered == list(range(batch * batch_size, (batch + 1) * batch_size))
+    elapsed = time.perf_counter() - start
+
+    print('{:<32} {:>10.2f} us/packet'.format(name, elapsed / (BATCHES * BATCH_SIZE) * 1e6))
+    print('{:<32} {:>10} / {}'.format('  bypassed', extension.bypassed_packets() - bypassed,
+                                      extension.intercepted_packets() - intercepted))
+
+
+if __name__ == '__main__':
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    extension = Extension({'title': 'bypass', 'description': '', 'version': '1', 'author': ''},
+                          ['-p', str(server.getsockname()[1])], silent=True)
+    extension.intercept(Direction.TO_SERVER, on_chat, LISTENED_HEADER)
+
+    starter = threading.Thread(target=extension.start)
+    starter.start()
+    gearth, _ = server.accept()
+    gearth.sendall(frame(IncomingMessages.INIT.value, b'\x00'))
+    starter.join()
+
+    # packets are answered in the order they were intercepted: in a burst, everything behind a packet with a
+    # listener waits for it, one packet at a time every packet without a listener is bypassed
+    reader = FrameReader(gearth)
+    run(extension, reader, gearth, 'mixed traffic, bursts', BATCH_SIZE)
+    run(extension, reader, gearth, 'mixed traffic, one at a time', 1)
+
+    extension.stop()
+    gearth.close()
+    server.close()
@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+
+from g_python.hcolumns import parse_floor_items, parse_entities, parse_user_updates
+from g_python.hparsers import HEntity, HUserUpdate, HFloorItem
+
+from parsers import users_packet, user_updates_packet, floor_items_packet
+
+ROUNDS = 20
+ENTRIES = 5000
+
+
+def bench(name: str, packet, parse) -> None:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        packet.reset()
+        parse(packet)
+    elapsed = time.perf_counter() - start
+    print('{:<40} {:>10.2f} ms/packet'.format(name, elapsed / ROUNDS * 1e3))
+
+
+def objects_to_array(items: list[HFloorItem]) -> np.ndarray:
+    return np.array([(item.tile.x, item.tile.y, item.height) for item in items])
+
+
+def updates_to_array(updates: list[HUserUpdate]) -> np.ndarray:
+    return np.array([(update.tile.x, update.tile.y, update.nextTile.x, update.nextTile.y) for update in updates])
+
+
+floor_items = floor_items_packet(ENTRIES)
+users = users_packet(ENTRIES)
+updates = user_updates_packet(ENTRIES)
+
+# the columns hold the same values as the objects
+floor_items.reset()
+columns = parse_floor_items(floor_items)
+floor_items.reset()
+assert [item.tile.x for item in HFloorItem.parse(floor_items)] == columns.items['x'].tolist()
+updates.reset()
+update_columns = parse_user_updates(updates)
+updates.reset()
+assert [(update.nextTile.x, update.nextTile.y, update.nextTile.z) for update in HUserUpdate.parse(updates)] == \
+       update_columns.updates[['next_x', 'next_y', 'next_z']].tolist()
+
+bench('HFloorItem.parse + np.array', floor_items, lambda packet: objects_to_array(HFloorItem.parse(packet)))
+bench('parse_floor_items', floor_items, parse_floor_items)
+bench('HEntity.parse', users, HEntity.parse)
+bench('parse_entities', users, parse_entities)
+bench('HUserUpdate.parse', updates, HUserUpdate.parse)
+bench('HUserUpdate.parse + np.array', updates, lambda packet: updates_to_array(HUserUpdate.parse(packet)))
+bench('parse_user_updates', updates, parse_user_updates)
+
+# a whole room query: items on the first row, in one pass instead of a loop over the objects
+items = columns.items
+start = time.perf_counter()
+for _ in range(ROUNDS):
+    ids = items['id'][(items['y'] == 0) & (items['height'] > 0.5)]
+print('{:<40} {:>10.2f} ms/query'.format('vectorized tile query', (time.perf_counter() - start) / ROUNDS * 1e3))
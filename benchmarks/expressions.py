@@ -0,0 +1,70 @@
+import socket
+import threading
+import time
+
+from g_python.gextension import IncomingMessages, OutgoingMessages
+from g_python.gstream import FrameReader
+from g_python.hdirection import Direction
+from g_python.hexpression import compile_expression
+from g_python.hpacket import HPacket
+
+ROUND_TRIPS = 20000
+LOCAL_COUNT = 500000
+
+expression = '{out:MoveAvatar}{i:3}{i:5}'
+packet_infos = {
+    Direction.TO_CLIENT: {},
+    Direction.TO_SERVER: {'MoveAvatar': [{'Id': 1001, 'Name': 'MoveAvatar', 'Hash': None, 'Structure': 'ii'}]}
+}
+
+
+def fake_gearth(sock: socket.socket) -> None:
+    # answers every STRING_TO_PACKET request right away, a real G-Earth also has to parse the expression
+    response = HPacket(IncomingMessages.STRING_TO_PACKET_RESPONSE.value)
+    response.append_string(repr(HPacket(1001, 3, 5)), 4, 'iso-8859-1')
+    response_bytes = bytes(response.bytearray)
+
+    reader = FrameReader(sock)
+    try:
+        while True:
+            for _ in reader.read_packets():
+                sock.sendall(response_bytes)
+    except (EOFError, OSError):
+        pass
+
+
+def bench_remote() -> float:
+    gearth, extension = socket.socketpair()
+    t = threading.Thread(target=fake_gearth, args=(gearth,))
+    t.start()
+
+    reader = FrameReader(extension)
+    start = time.perf_counter()
+    for _ in range(ROUND_TRIPS):
+        request = HPacket(OutgoingMessages.STRING_TO_PACKET_REQUEST.value)
+        request.append_string(expression, 4)
+        extension.sendall(request.bytearray)
+        response = reader.read_packets()[0]
+        HPacket.reconstruct_from_java(response.read_string(head=4, encoding='iso-8859-1'))
+    elapsed = time.perf_counter() - start
+
+    extension.close()
+    t.join()
+    gearth.close()
+    return elapsed / ROUND_TRIPS
+
+
+def bench_local() -> float:
+    start = time.perf_counter()
+    for _ in range(LOCAL_COUNT):
+        compile_expression(expression).to_packet(Direction.TO_SERVER, packet_infos)
+    return (time.perf_counter() - start) / LOCAL_COUNT
+
+
+assert bytes(compile_expression(expression).to_packet(Direction.TO_SERVER, packet_infos)) == \
+       bytes(HPacket(1001, 3, 5).bytearray)
+
+remote = bench_remote()
+local = bench_local()
+print('{:<32} {:>8.2f} us/packet'.format('remote (socketpair round-trip)', remote * 1e6))
+print('{:<32} {:>8.2f} us/packet'.format('local compiled expression', local * 1e6))
@@ -0,0 +1,81 @@
+import socket
+import threading
+import time
+
+from g_python.gstream import FrameReader
+from g_python.hpacket import HPacket
+
+FRAME_COUNT = 200000
+
+# a PACKET_INTERCEPT frame wrapping a typical status packet
+habbo_packet = HPacket(2002, 1, 5, 7, "0.0", 2, 2, "/flatctrl 4/mv 6,7,0.0//")
+payload = b'0\t1\tTOCLIENT\t0' + bytes(habbo_packet.bytearray)
+frame = bytes(HPacket(3).append_int(len(payload)).append_bytes(payload).bytearray)
+
+
+def legacy_read_packet(sock: socket.socket) -> HPacket:
+    write_pos = 0
+
+    length_buffer = bytearray(4)
+    while write_pos < 4:
+        n_read = sock.recv_into(memoryview(length_buffer)[write_pos:])
+        if n_read == 0:
+            raise EOFError
+        write_pos += n_read
+
+    packet_length = int.from_bytes(length_buffer, byteorder='big')
+    packet_buffer = length_buffer + bytearray(packet_length)
+
+    while write_pos < 4 + packet_length:
+        n_read = sock.recv_into(memoryview(packet_buffer)[write_pos:])
+        if n_read == 0:
+            raise EOFError
+        write_pos += n_read
+
+    return HPacket.from_bytes(packet_buffer)
+
+
+def fake_gearth(sock: socket.socket) -> None:
+    chunk = frame * 100
+    for _ in range(FRAME_COUNT // 100):
+        sock.sendall(chunk)
+    sock.close()
+
+
+def bench(name: str, read_all) -> None:
+    gearth, extension = socket.socketpair()
+    t = threading.Thread(target=fake_gearth, args=(gearth,))
+
+    start = time.perf_counter()
+    t.start()
+    count = read_all(extension)
+    elapsed = time.perf_counter() - start
+    t.join()
+    extension.close()
+
+    assert count == FRAME_COUNT
+    print('{:<16} {:>10.0f} frames/sec'.format(name, count / elapsed))
+
+
+def read_all_legacy(sock: socket.socket) -> int:
+    count = 0
+    try:
+        while True:
+            legacy_read_packet(sock)
+            count += 1
+    except EOFError:
+        return count
+
+
+def read_all_buffered(sock: socket.socket) -> int:
+    count = 0
+    reader = FrameReader(sock)
+    try:
+        while True:
+            count += len(reader.read_packets())
+    except EOFError:
+        return count
+
+
+bench('recv per frame', read_all_legacy)
+bench('FrameReader', read_all_buffered)
@@ -0,0 +1,69 @@
+import random
+import time
+
+import numpy as np
+
+from g_python.hcolumns import HHeightMapArray
+from g_python.hpacket import HPacket
+from g_python.hparsers import HHeightMap
+
+ROUNDS = 20
+SIZE = 96
+
+
+def height_map_packet(size: int = SIZE) -> HPacket:
+    random.seed(size)
+    packet = HPacket(2007, size, size * size)
+    with packet.editing():
+        for _ in range(size * size):
+            packet.append_short(random.choice([-1, 0, 256, 512, 16384 + 256]))
+    return packet
+
+
+def check_coords(width: int, height: int) -> None:
+    # every tile is as high as its index, so swapping x and y on a map that isn't square can't go unnoticed
+    packet = HPacket(2007, width, width * height)
+    with packet.editing():
+        for index in range(width * height):
+            packet.append_short(index * 256)
+
+    height_map = parse(HHeightMap, packet)
+    height_array = parse(HHeightMapArray, packet)
+    for y in range(height):
+        for x in range(width):
+            index = y * width + x
+            assert height_map.index_to_coords(index) == (x, y)
+            assert height_map.coords_to_index(x, y) == index
+            assert height_map.get_tile_height(*height_map.index_to_coords(index)) == index
+            assert height_array.get_tile_height(x, y) == index
+
+
+def bench(name: str, run) -> None:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        run()
+    elapsed = time.perf_counter() - start
+    print('{:<40} {:>10.2f} ms'.format(name, elapsed / ROUNDS * 1e3))
+
+
+def parse(cls, packet: HPacket):
+    packet.reset()
+    return cls(packet)
+
+
+if __name__ == '__main__':
+    check_coords(7, 3)
+    check_coords(3, 7)
+
+    packet = height_map_packet()
+    height_map = parse(HHeightMap, packet)
+    height_array = parse(HHeightMapArray, packet)
+    xs, ys = np.meshgrid(np.arange(-1, SIZE + 1), np.arange(-1, SIZE + 1))
+    assert [height_map.get_tile_height(x, y) for x, y in zip(xs.ravel(), ys.ravel())] == \
+           height_array.get_tile_height(xs, ys).ravel().tolist()
+
+    bench('HHeightMap + get_tiles()', lambda: parse(HHeightMap, packet).get_tiles())
+    bench('HHeightMapArray', lambda: parse(HHeightMapArray, packet))
+    bench('get_tile_height per tile',
+          lambda: [height_map.get_tile_height(x, y) for y in range(SIZE) for x in range(SIZE)])
+    bench('HHeightMapArray.get_tile_height(xs, ys)', lambda: height_array.get_tile_height(xs, ys))
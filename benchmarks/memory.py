@@ -0,0 +1,44 @@
+import gc
+import tracemalloc
+
+from g_python.hmessage import HMessage, Direction
+from g_python.hpacket import HPacket
+from g_python.hparsers import HEntity, HUserUpdate, HFloorItem, HWallItem, HInventoryItem
+
+from parsers import users_packet, user_updates_packet, floor_items_packet, wall_items_packet, inventory_packet
+
+COUNT = 10000
+
+
+def measure(name: str, create) -> None:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = create()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert len(objects) == COUNT
+    # an instance dict would undo the savings of __slots__
+    assert not any(hasattr(obj, '__dict__') for obj in objects), '{} instances have a __dict__'.format(name)
+    print('{:<20} {:>8.0f} bytes each'.format(name, (after - before) / len(objects)))
+
+
+if __name__ == '__main__':
+    # the packets are built up front, only the parsed objects are measured
+    users = users_packet(COUNT)
+    updates = user_updates_packet(COUNT)
+    floor_items = floor_items_packet(COUNT)
+    wall_items = wall_items_packet(COUNT)
+    inventory = inventory_packet(COUNT)
+    raw_packet = bytes(HPacket(1000, 'hello', 0, 1).bytearray)
+
+    measure('HEntity', lambda: HEntity.parse(users))
+    measure('HUserUpdate', lambda: HUserUpdate.parse(updates))
+    measure('HFloorItem', lambda: HFloorItem.parse(floor_items))
+    measure('HWallItem', lambda: HWallItem.parse(wall_items))
+    measure('HInventoryItem', lambda: HInventoryItem.parse(inventory))
+    measure('HPacket', lambda: [HPacket(1000, 'hello', i, True) for i in range(COUNT)])
+    measure('HPacket.from_bytes', lambda: [HPacket.from_bytes(raw_packet) for _ in range(COUNT)])
+    measure('HPacket.from_buffer', lambda: [HPacket.from_buffer(raw_packet) for _ in range(COUNT)])
+    measure('HMessage', lambda: [HMessage(HPacket.from_bytes(raw_packet), Direction.TO_SERVER, i) for i in range(COUNT)])
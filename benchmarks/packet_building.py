@@ -0,0 +1,58 @@
+import time
+from contextlib import nullcontext
+
+from g_python.hpacket import HPacket
+
+ROUNDS = 20
+FRIENDS = 1000
+FLOOR_ITEMS = 2000
+STRING_EDITS = 2000
+
+
+def friend_list_update(packet: HPacket) -> None:
+    packet.append_int(0).append_int(FRIENDS)
+    for i in range(FRIENDS):
+        packet.append_int(0).append_int(1000 + i).append_string('friend{}'.format(i)).append_int(1)
+        packet.append_bool(True).append_bool(False).append_string('hd-180-1.ch-210-66.lg-270-82')
+        packet.append_int(0).append_string('motto').append_string('').append_string('')
+        packet.append_bool(False).append_bool(False).append_bool(False).append_short(0)
+
+
+def objects(packet: HPacket) -> None:
+    packet.append_int(1).append_int(7).append_string('owner').append_int(FLOOR_ITEMS)
+    for i in range(FLOOR_ITEMS):
+        packet.append_int(i).append_int(3000 + i).append_int(i % 64).append_int(i // 64).append_int(2)
+        packet.append_string('0.0').append_string('1.0').append_int(0).append_int(0).append_string('0')
+        packet.append_int(-1).append_int(0).append_int(7)
+
+
+def bench_build(name: str, build, deferred: bool) -> bytes:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        packet = HPacket(2000)
+        with packet.editing() if deferred else nullcontext():
+            build(packet)
+    elapsed = time.perf_counter() - start
+    print('{:<36} {:>10.2f} ms/packet'.format(name, elapsed / ROUNDS * 1e3))
+    return bytes(packet.bytearray)
+
+
+def bench_replace_string() -> None:
+    # a chat filter rewriting every string of an Objects sized packet
+    packet = HPacket(2000)
+    objects(packet)
+    index = 6 + 4 + 4 + 2 + len('owner') + 4 + 20
+
+    start = time.perf_counter()
+    for i in range(STRING_EDITS):
+        packet.replace_string(index, 'x' * (i % 7))
+    elapsed = time.perf_counter() - start
+    print('{:<36} {:>10.2f} us/edit ({} byte packet)'.format('replace_string', elapsed / STRING_EDITS * 1e6,
+                                                             len(packet.bytearray)))
+
+
+assert bench_build('FriendListUpdate, fix_length per value', friend_list_update, False) == \
+       bench_build('FriendListUpdate, editing()', friend_list_update, True)
+assert bench_build('Objects, fix_length per value', objects, False) == \
+       bench_build('Objects, editing()', objects, True)
+bench_replace_string()
@@ -0,0 +1,77 @@
+import time
+
+from g_python.hpacket import HPacket
+from g_python.hparsers import HEntity, HUserUpdate, HFloorItem, HWallItem
+
+ROUNDS = 200
+ENTRIES = 50
+
+
+def users_packet(entries: int = ENTRIES) -> HPacket:
+    packet = HPacket(2001, entries)
+    for i in range(entries):
+        packet.append_int(1000 + i).append_string('user{}'.format(i)).append_string('motto')
+        packet.append_string('hd-180-1.ch-210-66.lg-270-82.sh-290-91').append_int(i).append_int(i % 20)
+        packet.append_int(i // 20).append_string('0.0').append_int(2).append_int(1)
+        packet.append_string('M').append_int(-1).append_int(-1).append_string('').append_string('')
+        packet.append_int(0).append_bool(False)
+    return packet
+
+
+def user_updates_packet(entries: int = ENTRIES) -> HPacket:
+    packet = HPacket(2002, entries)
+    for i in range(entries):
+        packet.append_int(i).append_int(i % 20).append_int(i // 20).append_string('0.0').append_int(2)
+        packet.append_int(2).append_string('/flatctrl 4/mv {},{},0.0//'.format(i % 20 + 1, i // 20))
+    return packet
+
+
+def floor_items_packet(entries: int = ENTRIES) -> HPacket:
+    packet = HPacket(2003, 1, 7, 'owner', entries)
+    for i in range(entries):
+        packet.append_int(i).append_int(3000 + i).append_int(i % 20).append_int(i // 20).append_int(2)
+        packet.append_string('0.0').append_string('1.0').append_int(0).append_int(0).append_string('0')
+        packet.append_int(-1).append_int(0).append_int(7)
+    return packet
+
+
+def wall_items_packet(entries: int = ENTRIES) -> HPacket:
+    packet = HPacket(2004, 1, 7, 'owner', entries)
+    for i in range(entries):
+        packet.append_string(str(i)).append_int(4000 + i).append_string(':w=3,{} l=10,52 r'.format(i))
+        packet.append_string('0').append_int(-1).append_int(0).append_int(7)
+    return packet
+
+
+def inventory_packet(entries: int = ENTRIES) -> HPacket:
+    packet = HPacket(2006, 1, 0, entries)
+    for i in range(entries):
+        packet.append_int(i).append_string('S').append_int(i).append_int(3000 + i % 300).append_int(1)
+        packet.append_int(0).append_string('0').append_bool(True).append_bool(True).append_bool(True)
+        packet.append_bool(True).append_int(-1).append_bool(False).append_int(-1).append_string('')
+        packet.append_int(0)
+    return packet
+
+
+def entity_fields_packet() -> HPacket:
+    return HPacket(2005, 1, 'user', 'motto', 'hd-180-1', 3, 4, 5, '0.0', 2, 1)
+
+
+def bench(name: str, packet: HPacket, parse) -> None:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        packet.reset()
+        parse(packet)
+    elapsed = time.perf_counter() - start
+    print('{:<28} {:>10.2f} us/packet'.format(name, elapsed / ROUNDS * 1e6))
+
+
+if __name__ == '__main__':
+    bench('HEntity.parse', users_packet(), HEntity.parse)
+    bench('HUserUpdate.parse', user_updates_packet(), HUserUpdate.parse)
+    bench('HFloorItem.parse', floor_items_packet(), HFloorItem.parse)
+    bench('HWallItem.parse', wall_items_packet(), HWallItem.parse)
+    bench('HEntity.parse(lazy=True)', users_packet(), lambda packet: HEntity.parse(packet, lazy=True))
+    bench('  + index, tile', users_packet(),
+          lambda packet: [(entity.index, entity.tile) for entity in HEntity.parse(packet, lazy=True)])
+    bench("read('isssiiisii')", entity_fields_packet(), lambda packet: packet.read('isssiiisii'))
@@ -0,0 +1,71 @@
+import random
+import time
+
+from g_python.hpacket import HPacket
+from g_python.hparsers import HHeightMap, HFloorItem, HPoint
+from g_python.hpathfinding import PathFinder
+
+from heightmap import height_map_packet
+
+ROUNDS = 200
+SIZE = 64
+
+
+def floor_item(item_id: int, x: int, y: int) -> HFloorItem:
+    item = HFloorItem.__new__(HFloorItem)
+    item.id, item.type_id, item.tile, item.facing, item.height = item_id, 1, HPoint(x, y, 0.0), 0, 1.0
+    return item
+
+
+def bench(name: str, run) -> None:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        run()
+    elapsed = time.perf_counter() - start
+    print('{:<40} {:>10.3f} ms/query'.format(name, elapsed / ROUNDS * 1e3))
+
+
+def check_occupied_step() -> None:
+    # a tile someone stands on has a distance in the field, but next_step has to walk around it like find_path
+    packet = HPacket(2007, 3, 9)
+    with packet.editing():
+        for _ in range(9):
+            packet.append_short(0)
+    finder = PathFinder(HHeightMap(packet))
+    finder.set_user(0, HPoint(1, 0))
+
+    step = finder.next_step((0, 0), (2, 1))
+    path = finder.find_path((0, 0), (2, 1))
+    assert finder.is_walkable(step.x, step.y)
+    assert (step.x, step.y) == (path[0].x, path[0].y) == (1, 1)
+
+
+def rebuild_and_find(height_map, items, start, goal):
+    # what a bot without a shared grid does: rebuild the room state for every query
+    rebuilt = PathFinder(height_map)
+    rebuilt.set_floor_furni(items)
+    return rebuilt.find_path(start, goal)
+
+
+if __name__ == '__main__':
+    check_occupied_step()
+
+    random.seed(1)
+    height_map = HHeightMap(height_map_packet(SIZE))
+    items = [floor_item(i, random.randrange(SIZE), random.randrange(SIZE)) for i in range(SIZE * SIZE // 10)]
+    finder = PathFinder(height_map)
+    finder.set_floor_furni(items)
+
+    start = (0, 0)
+    goal = (SIZE - 1, SIZE - 1)
+    while not finder.is_walkable(*goal):
+        goal = (goal[0] - 1, goal[1])
+
+    path = finder.find_path(start, goal)
+    print('path of {} steps'.format(None if path is None else len(path)))
+
+    bench('rebuild grid + find_path', lambda: rebuild_and_find(height_map, items, start, goal))
+    bench('find_path', lambda: finder.find_path(start, goal))
+    bench('next_step (cached distance field)', lambda: finder.next_step(start, goal))
+    bench('move a furni + next_step', lambda: (finder.add_furni(floor_item(0, random.randrange(SIZE), 0)),
+                                               finder.next_step(start, goal)))
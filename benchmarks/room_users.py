@@ -0,0 +1,52 @@
+import time
+
+from g_python.hmessage import HMessage, Direction
+from g_python.hparsers import HUserUpdate
+from g_python.htools import RoomUsers
+
+from parsers import users_packet, user_updates_packet
+
+ROUNDS = 500
+USERS = 200
+
+
+class FakeExtension:
+    packet_infos = None
+    connection_info = None
+
+    def __init__(self):
+        self.handlers = {}
+
+    def on_event(self, *_) -> None:
+        pass
+
+    def intercept(self, _, callback, header) -> None:
+        self.handlers[header] = callback
+
+    def send_to_server(self, _) -> bool:
+        return True
+
+
+def bench(name: str, run) -> None:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        run()
+    elapsed = time.perf_counter() - start
+    print('{:<40} {:>10.2f} us'.format(name, elapsed / ROUNDS * 1e6))
+
+
+if __name__ == '__main__':
+    extension = FakeExtension()
+    room_users = RoomUsers(extension)
+    extension.handlers['Users'](HMessage(users_packet(USERS), Direction.TO_CLIENT, 0))
+
+    status = user_updates_packet(USERS)
+    status.reset()
+    updates = HUserUpdate.parse(status)
+
+    bench('apply_updates ({} users)'.format(USERS), lambda: room_users.apply_updates(updates))
+    bench('users_on_tile', lambda: room_users.users_on_tile(5, 5))
+    bench('users_within radius 3', lambda: room_users.users_within(5, 5, 3))
+    bench('scan room_users within radius 3', lambda: [user for user in room_users.room_users.values()
+                                                       if abs(user.tile.x - 5) <= 3 and abs(user.tile.y - 5) <= 3])
+    bench('nearest_users(count=5)', lambda: room_users.nearest_users(5, 5, 5))
@@ -0,0 +1,45 @@
+import random
+import time
+
+from g_python.hpacket import HPacket
+from g_python.hparsers import HUserUpdate
+
+ROUNDS = 2000
+USERS = 100
+
+
+def status_stream(packets: int = 50, users: int = USERS) -> list[HPacket]:
+    """
+    Status packets as a busy room sends them: most users stand still, some walk, sit, hold up a sign or have rights
+    """
+    random.seed(users)
+    actions = ['//', '//', '//', '/flatctrl 4//', '/mv {},{},0.0//', '/flatctrl 1/mv {},{},1.0//', '/sit 0.5 1//',
+               '/lay 1.0 0//', '/sign 7//']
+    stream = []
+    for _ in range(packets):
+        packet = HPacket(2002, users)
+        for index in range(users):
+            x, y = random.randrange(30), random.randrange(30)
+            action = random.choice(actions).format(x + 1, y)
+            packet.append_int(index).append_int(x).append_int(y).append_string('0.0').append_int(2).append_int(2)
+            packet.append_string(action)
+        stream.append(packet)
+    return stream
+
+
+def bench(name: str, stream: list[HPacket], run) -> None:
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        packet = stream[i % len(stream)]
+        packet.reset()
+        run(packet)
+    elapsed = time.perf_counter() - start
+    print('{:<40} {:>10.2f} us/packet'.format(name, elapsed / ROUNDS * 1e6))
+
+
+if __name__ == '__main__':
+    stream = status_stream()
+    bench('HUserUpdate.parse', stream, HUserUpdate.parse)
+    bench('HUserUpdate.parse + tile', stream, lambda packet: [update.tile for update in HUserUpdate.parse(packet)])
+    bench('HUserUpdate.parse + nextTile', stream,
+          lambda packet: [update.nextTile for update in HUserUpdate.parse(packet)])
@@ -0,0 +1,494 @@
+import asyncio
+import copy
+import inspect
+import socket
+import sys
+from collections import deque
+from typing import Callable, Awaitable, Iterable, Hashable
+
+from .gextension import ExtensionInfo, ExtensionSettings, IncomingMessages, OutgoingMessages, InterceptMethod, \
+    ConsoleColour, MINIMUM_GEARTH_VERSION, EXTENSION_SETTINGS_DEFAULT, fill_settings, read_extension_arguments, \
+    extension_info_packet, console_log_packet, parse_packet_infos, send_message_buffers, \
+    manipulated_packet_buffers, echo_intercept_buffers, template_message_buffers
+from .hpacket import HPacket, PacketTemplate
+from .hexpression import PacketFormatter, packet_to_string, compile_expression
+from .hmessage import HMessage, Direction, peek_intercept
+from .gdispatch import InterceptTable, LaneKey, header_lane_key
+
+AsyncInterceptCallback = Callable[[HMessage], None | Awaitable[None]]
+
+
+async def run_callback(func: Callable, *args) -> None:
+    result = func(*args)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def run_callbacks(callbacks: list[Callable[[], None | Awaitable[None]]]) -> None:
+    for func in callbacks:
+        await run_callback(func)
+
+
+class AsyncExtension:
+    """
+    asyncio counterpart of Extension: everything runs as tasks on a single event loop, intercept callbacks and
+    events may be either plain functions or coroutine functions
+    """
+
+    def __init__(self, extension_info: ExtensionInfo, args: list[str],
+                 extension_settings: None | ExtensionSettings = None, silent: bool = False):
+        if not silent:
+            print("WARNING: This version of G-Python requires G-Earth >= {}".format(MINIMUM_GEARTH_VERSION),
+                  file=sys.stderr)
+
+        extension_settings = fill_settings(extension_settings, EXTENSION_SETTINGS_DEFAULT)
+        port, file, cookie = read_extension_arguments(extension_info, args)
+
+        self.__reader = None
+        self.__writer = None
+        self.__lost_packets = 0
+        self.__bypassed_packets = 0
+        self.__intercepted_packets = 0
+
+        self._extension_info = extension_info
+        self.__port = port
+        self.__file = file
+        self.__cookie = cookie
+        self._extension_settings = extension_settings
+
+        self.connection_info = None
+        self.packet_infos = None
+        self.__formatter = PacketFormatter(None)
+
+        self.__started = None
+        self.__await_connect_packet = False
+        self.__closed = None
+
+        self.__events = {}
+        self.__intercept_table = InterceptTable()
+
+        self.__responses = {
+            IncomingMessages.FLAGS_CHECK: deque(),
+            IncomingMessages.PACKET_TO_STRING_RESPONSE: deque(),
+            IncomingMessages.STRING_TO_PACKET_RESPONSE: deque()
+        }
+
+        self.__manipulate_messages = None
+        self.__unfinished = 0
+        self.__tasks = set()
+        self.__lanes = {}
+
+    def __spawn(self, coroutine) -> asyncio.Task:
+        # the event loop only keeps weak references to tasks
+        task = asyncio.create_task(coroutine)
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+        return task
+
+    def __spawn_in_lane(self, key: Hashable, coroutine) -> None:
+        previous = self.__lanes.get(key)
+
+        async def run_after_previous() -> None:
+            if previous is not None:
+                await asyncio.wait((previous,))
+            await coroutine
+
+        task = self.__spawn(run_after_previous())
+        self.__lanes[key] = task
+
+        def release_lane(_) -> None:
+            if self.__lanes.get(key) is task:
+                del self.__lanes[key]
+
+        task.add_done_callback(release_lane)
+
+    async def __read_gearth_packet(self) -> HPacket:
+        length_buffer = await self.__reader.readexactly(4)
+        packet_length = int.from_bytes(length_buffer, byteorder='big')
+        return HPacket.from_bytes(length_buffer + await self.__reader.readexactly(packet_length))
+
+    async def __packet_manipulation_task(self) -> None:
+        while True:
+            habbo_message = await self.__manipulate_messages.get()
+
+            # the packet isn't bound to this extension, the conversions of HPacket (g_string, ...) are synchronous
+            habbo_packet = habbo_message.packet
+
+            for (func, skip_if_blocked) in self.__intercept_table.listeners(habbo_message.direction,
+                                                                           habbo_packet.header_id()):
+                if skip_if_blocked and habbo_message.is_blocked:
+                    continue
+                await run_callback(func, habbo_message)
+                habbo_packet.reset()
+
+            self.__write_buffers(manipulated_packet_buffers(habbo_message))
+            self.__unfinished -= 1
+            await self.__writer.drain()
+
+    async def __connection_task(self) -> None:
+        manipulation_task = self.__spawn(self.__packet_manipulation_task())
+        try:
+            while True:
+                packet = await self.__read_gearth_packet()
+                await self.__handle_gearth_packet(packet)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            manipulation_task.cancel()
+            self.__writer.close()
+            for futures in self.__responses.values():
+                while len(futures) > 0:
+                    futures.popleft().set_exception(ConnectionError('Connection with G-Earth was closed'))
+            if not self.__started.done():
+                self.__started.set_exception(ConnectionError('Connection with G-Earth was closed'))
+            self.__closed.set_result(None)
+
+    def __set_response(self, message_type: IncomingMessages, response) -> None:
+        futures = self.__responses[message_type]
+        if len(futures) > 0:
+            future = futures.popleft()
+            if not future.done():
+                future.set_result(response)
+
+    async def __handle_gearth_packet(self, packet: HPacket) -> None:
+        message_type = IncomingMessages(packet.header_id())
+        if message_type == IncomingMessages.PACKET_INTERCEPT:
+            frame = packet.buffer()
+            self.__intercepted_packets += 1
+            # packets nobody listens to are answered right away, unless that would overtake others
+            if self.__unfinished == 0 and not self.__intercept_table.has_listeners(*peek_intercept(frame)):
+                self.__write_buffers(echo_intercept_buffers(frame))
+                self.__bypassed_packets += 1
+            else:
+                self.__unfinished += 1
+                self.__manipulate_messages.put_nowait(HMessage.from_intercept(frame))
+
+        elif message_type == IncomingMessages.INFO_REQUEST:
+            await self.__send_to_stream(extension_info_packet(self._extension_info, self._extension_settings,
+                                                              self.__file, self.__cookie))
+
+        elif message_type == IncomingMessages.CONNECTION_START:
+            host, port, hotel_version, client_identifier, client_type = packet.read("sisss")
+            self.packet_infos = parse_packet_infos(packet)
+            self.__intercept_table.compile(self.packet_infos)
+            self.__formatter = PacketFormatter(self.packet_infos)
+
+            self.connection_info = {'host': host, 'port': port, 'hotel_version': hotel_version,
+                                    'client_identifier': client_identifier, 'client_type': client_type}
+
+            self.__raise_event('connection_start')
+
+            if self.__await_connect_packet:
+                self.__await_connect_packet = False
+                self.__started.set_result(None)
+
+        elif message_type == IncomingMessages.CONNECTION_END:
+            self.__raise_event('connection_end')
+            self.connection_info = None
+            self.packet_infos = None
+            self.__intercept_table.compile(None)
+            self.__formatter = PacketFormatter(None)
+
+        elif message_type == IncomingMessages.FLAGS_CHECK:
+            size = packet.read_int()
+            self.__set_response(message_type, [packet.read_string() for _ in range(size)])
+
+        elif message_type == IncomingMessages.INIT:
+            self.__raise_event('init')
+            await self.write_to_console(
+                'g_python extension "{}" sucessfully initialized'.format(self._extension_info['title']),
+                ConsoleColour.GREEN,
+                False
+            )
+
+            self.__await_connect_packet = packet.read_bool()
+            if not self.__await_connect_packet:
+                self.__started.set_result(None)
+
+        elif message_type == IncomingMessages.ON_DOUBLE_CLICK:
+            self.__raise_event('double_click')
+
+        elif message_type == IncomingMessages.PACKET_TO_STRING_RESPONSE:
+            string = packet.read_string(head=4, encoding='iso-8859-1')
+            expression = packet.read_string(head=4, encoding='utf-8')
+            self.__set_response(message_type, (string, expression))
+
+        elif message_type == IncomingMessages.STRING_TO_PACKET_RESPONSE:
+            packet_string = packet.read_string(head=4, encoding='iso-8859-1')
+            self.__set_response(message_type, HPacket.reconstruct_from_java(packet_string))
+
+    def __write_buffers(self, buffers: Iterable[bytes | bytearray | memoryview]) -> None:
+        # joined into a single copy, the transport may hold on to the buffers until they are sent
+        self.__writer.write(b''.join(buffers))
+
+    async def __send_to_stream(self, packet: HPacket) -> None:
+        self.__writer.write(bytes(packet.buffer()))
+        await self.__writer.drain()
+
+    def __raise_event(self, event_name: str) -> None:
+        if event_name in self.__events:
+            self.__spawn(run_callbacks(list(self.__events[event_name])))
+
+    async def __send(self, direction: Direction, packet: HPacket) -> bool:
+        if not self.is_closed():
+            buffers = send_message_buffers(direction, packet, self)
+            if buffers is None:
+                self.__lost_packets += 1
+                return False
+
+            self.__write_buffers(buffers)
+            await self.__writer.drain()
+            return True
+        else:
+            self.__lost_packets += 1
+            return False
+
+    def is_closed(self) -> bool:
+        """
+        :return: true if no extension isn't connected with G-Earth
+        """
+        return self.__writer is None or self.__writer.is_closing()
+
+    def bypassed_packets(self) -> int:
+        """
+        :return: amount of intercepted packets without listeners that were answered without being dispatched
+        """
+        return self.__bypassed_packets
+
+    def intercepted_packets(self) -> int:
+        """
+        :return: amount of packets G-Earth passed to the extension, bypassed or not
+        """
+        return self.__intercepted_packets
+
+    async def send_to_client(self, packet: HPacket | str) -> bool:
+        """
+        Sends a message to the client
+        :param packet: a HPacket() or a string representation
+        """
+
+        if type(packet) is str:
+            packet = await self.__string_to_packet(packet, Direction.TO_CLIENT)
+        return await self.__send(Direction.TO_CLIENT, packet)
+
+    async def send_to_server(self, packet: HPacket | str) -> bool:
+        """
+        Sends a message to the server
+        :param packet: a HPacket() or a string representation
+        """
+
+        if type(packet) is str:
+            packet = await self.__string_to_packet(packet, Direction.TO_SERVER)
+        return await self.__send(Direction.TO_SERVER, packet)
+
+    async def send_template(self, template: PacketTemplate, *values: int | str | bool) -> bool:
+        """
+        Sends a packet built from a PacketTemplate, in the direction of the template
+        :param values: one value per type in the structure of the template
+        """
+        if self.is_closed():
+            self.__lost_packets += 1
+            return False
+
+        buffers = template_message_buffers(template, values, self)
+        if buffers is None:
+            self.__lost_packets += 1
+            return False
+
+        self.__write_buffers(buffers)
+        await self.__writer.drain()
+        return True
+
+    async def send_many(self, direction: Direction, packets: Iterable[HPacket | str]) -> int:
+        """
+        Sends a burst of messages in a single write
+        :param direction: Direction.TO_CLIENT or Direction.TO_SERVER
+        :param packets: HPacket() objects or string representations
+        :return: amount of packets that were sent
+        """
+        if self.is_closed():
+            return 0
+
+        buffers = []
+        for packet in packets:
+            if type(packet) is str:
+                packet = await self.__string_to_packet(packet, direction)
+            packet_buffers = send_message_buffers(direction, packet, self)
+            if packet_buffers is None:
+                self.__lost_packets += 1
+            else:
+                buffers.extend(packet_buffers)
+
+        self.__write_buffers(buffers)
+        await self.__writer.drain()
+        return len(buffers) // 2
+
+    def on_event(self, event_name: str, func: Callable[[], None | Awaitable[None]]) -> None:
+        """
+        implemented event names: double_click, connection_start, connection_end, init. When this
+        event occurs, "func" is called (and awaited if it is a coroutine function)
+        """
+        if event_name in self.__events:
+            self.__events[event_name].append(func)
+        else:
+            self.__events[event_name] = [func]
+
+    def intercept(self, direction: Direction, callback: AsyncInterceptCallback, identifier: int | str = -1,
+                  mode: InterceptMethod = InterceptMethod.DEFAULT, priority: int = 0,
+                  skip_if_blocked: bool = False, lane_key: None | LaneKey = None) -> None:
+        """
+        :param direction: Direction.TOCLIENT or Direction.TOSERVER
+        :param callback: function or coroutine function that takes HMessage as an argument
+        :param identifier: header_id / hash / name
+        :param mode: can be: * default (awaited before the packet continues)
+                             * async (separate task, can't modify packet, doesn't disturb packet flow)
+                             * async_modify (separate task, can modify, doesn't block other packets,
+                                             disturbs packet flow)
+                             * async_ordered (like async_modify, but packets in the same lane are handled and
+                                              sent one after another, in the order they were intercepted)
+        :param priority: listeners with a higher priority are called first
+        :param skip_if_blocked: don't call this listener for packets blocked by an earlier listener
+        :param lane_key: async_ordered only, function that maps a HMessage to its lane. By default every
+                         direction + header id is a lane
+        :return:
+        """
+        original_callback = callback
+
+        if mode == 'async':
+            def new_callback(hmessage: HMessage) -> None:
+                copied = copy.copy(hmessage)
+                self.__spawn(run_callback(original_callback, copied))
+
+            callback = new_callback
+
+        if mode == 'async_modify':
+            async def callback_send(hmessage: HMessage) -> None:
+                await run_callback(original_callback, hmessage)
+                if not hmessage.is_blocked:
+                    await self.__send(hmessage.direction, hmessage.packet)
+
+            def new_callback(hmessage: HMessage) -> None:
+                hmessage.is_blocked = True
+                copied = copy.copy(hmessage)
+                copied.is_blocked = False
+                self.__spawn(callback_send(copied))
+
+            callback = new_callback
+
+        if mode == 'async_ordered':
+            key_function = header_lane_key if lane_key is None else lane_key
+
+            async def callback_send(hmessage: HMessage) -> None:
+                await run_callback(original_callback, hmessage)
+                if not hmessage.is_blocked:
+                    await self.__send(hmessage.direction, hmessage.packet)
+
+            def new_callback(hmessage: HMessage) -> None:
+                hmessage.is_blocked = True
+                copied = copy.copy(hmessage)
+                copied.is_blocked = False
+                self.__spawn_in_lane(key_function(hmessage), callback_send(copied))
+
+            callback = new_callback
+
+        self.__intercept_table.add(direction, identifier, callback, priority, skip_if_blocked)
+
+    def remove_intercept(self, intercept_id: int | str = -1) -> None:
+        """
+        Clear intercepts per id or all of them when none is given
+        """
+        self.__intercept_table.remove(intercept_id)
+
+    async def start(self) -> None:
+        """
+        Sets up a connection with G-Earth, returns once the extension is initialized
+        """
+        if not self.is_closed():
+            raise Exception("Attempted to run already-running extension")
+
+        self.__reader, self.__writer = await asyncio.open_connection("127.0.0.1", self.__port)
+        self.__writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        loop = asyncio.get_running_loop()
+        self.__started = loop.create_future()
+        self.__closed = loop.create_future()
+        self.__manipulate_messages = asyncio.Queue()
+        self.__unfinished = 0
+        self.__spawn(self.__connection_task())
+        await self.__started
+
+    async def wait_closed(self) -> None:
+        """
+        Waits until the connection with G-Earth is closed
+        """
+        if self.__closed is not None:
+            await asyncio.shield(self.__closed)
+
+    def stop(self) -> None:
+        """
+        Aborts an existing connection with G-Earth
+        """
+        if not self.is_closed():
+            self.__writer.close()
+        else:
+            raise Exception("Attempted to close extension that wasn't running")
+
+    async def write_to_console(self, text, color: ConsoleColour = ConsoleColour.BLACK,
+                               mention_title: bool = True) -> None:
+        """
+        Writes a message to the G-Earth console
+        """
+        await self.__send_to_stream(console_log_packet(self._extension_info, text, color, mention_title))
+
+    async def __await_response(self, request: HPacket, message_type: IncomingMessages) \
+            -> str | list[str] | HPacket:
+        # G-Earth answers requests of the same kind in order, so responses are matched first come first served
+        future = asyncio.get_running_loop().create_future()
+        self.__responses[message_type].append(future)
+        await self.__send_to_stream(request)
+        return await future
+
+    async def packet_to_string(self, packet: HPacket) -> str:
+        """
+        Renders the G-Earth string representation of a packet locally
+        """
+        return packet_to_string(packet)
+
+    async def packet_to_expression(self, packet: HPacket, direction: Direction | None = None) -> str:
+        """
+        Renders the expression locally when the structure of the packet is known, otherwise asks G-Earth
+        :param direction: resolves header ids that exist in both directions
+        """
+        expression = self.__formatter.to_expression(packet, direction)
+        if expression is not None:
+            return expression
+
+        request = HPacket(OutgoingMessages.PACKET_TO_STRING_REQUEST.value)
+        request.append_string(repr(packet), 4, 'iso-8859-1')
+
+        return (await self.__await_response(request, IncomingMessages.PACKET_TO_STRING_RESPONSE))[1]
+
+    async def packets_to_strings(self, packets: Iterable[HPacket]) -> list[str]:
+        return [packet_to_string(packet) for packet in packets]
+
+    async def __string_to_packet(self, string: str, direction: Direction | None) -> HPacket:
+        template = compile_expression(string)
+        packet = None if template is None else template.to_packet(direction, self.packet_infos)
+        if packet is not None:
+            return packet
+
+        request = HPacket(OutgoingMessages.STRING_TO_PACKET_REQUEST.value)
+        request.append_string(string, 4)
+
+        return await self.__await_response(request, IncomingMessages.STRING_TO_PACKET_RESPONSE)
+
+    async def string_to_packet(self, string: str) -> HPacket:
+        """
+        Expressions like {out:MoveAvatar}{i:3}{i:5} are compiled locally (and cached), anything else is converted
+        by G-Earth
+        """
+        return await self.__string_to_packet(string, None)
+
+    async def request_flags(self) -> list[str]:
+        return await self.__await_response(HPacket(OutgoingMessages.REQUEST_FLAGS.value),
+                                           IncomingMessages.FLAGS_CHECK)
@@ -6,7 +6,10 @@ from typing import Callable, TypedDict, NotRequired
 from g_python.gextension import Extension, InterceptMethod
 from g_python.hdirection import Direction
 from g_python.hmessage import HMessage
-from g_python.hpacket import HPacket
+from g_python.hpacket import HPacket, PacketTemplate
+
+FRIEND_LIST_UPDATE = PacketTemplate(Direction.TO_CLIENT, "FriendListUpdate", "iiBBsisiBBsisiBBBi")
+NEW_CONSOLE = PacketTemplate(Direction.TO_CLIENT, "NewConsole", "isis")
 
 
 class HBotProfile(TypedDict):
@@ -100,7 +103,7 @@ class ConsoleBot:
     def on_send_message(self, hmessage: HMessage) -> None:
         packet = hmessage.packet
 
-        if packet.read_int() == self._bot_settings.id:
+        if packet.read_int() == self._bot_settings["id"]:
             hmessage.is_blocked = True
             message = packet.read_string()
 
@@ -126,24 +129,20 @@ class ConsoleBot:
     def create_chat(self) -> None:
         bot = self._bot_settings
 
-        packet = HPacket("FriendListUpdate", 0, 1, False, False, "", bot["id"], bot["username"], bot["gender"],
-                         bot["is_online"], bot["is_following_allowed"], bot["figure"], bot["category_id"],
-                         bot["motto"], 0, bot["is_persisted_message_user"], bot["is_vip_member"],
-                         bot["is_pocket_habbo_user"], 65537)
-
-        self._extension.send_to_client(packet)
+        self._extension.send_template(FRIEND_LIST_UPDATE, 0, 1, False, False, "", bot["id"], bot["username"],
+                                      bot["gender"], bot["is_online"], bot["is_following_allowed"], bot["figure"],
+                                      bot["category_id"], bot["motto"], 0, bot["is_persisted_message_user"],
+                                      bot["is_vip_member"], bot["is_pocket_habbo_user"], 65537)
 
     def send(self, message: str, as_invite: bool = False) -> None:
         if as_invite:
             self._extension.send_to_client(
-                HPacket("RoomInvite", self._bot_settings.id, message)
+                HPacket("RoomInvite", self._bot_settings["id"], message)
             )
 
             return None
 
-        self._extension.send_to_client(
-            HPacket("NewConsole", self._bot_settings.id, message, 0, "")
-        )
+        self._extension.send_template(NEW_CONSOLE, self._bot_settings["id"], message, 0, "")
 
     def add_command(self, command: str, callback: Callable[[], None]) -> None:
         self._commands[command] = callback
@@ -0,0 +1,430 @@
+import threading
+import time
+import traceback
+from collections import deque
+from enum import StrEnum
+from typing import TypedDict, NotRequired, Iterable, Any, Callable, Hashable
+
+from .hmessage import HMessage, Direction
+
+DEFAULT_BATCH_SIZE: int = 64
+
+LaneKey = Callable[[HMessage], Hashable]
+
+
+class QueueMetrics(TypedDict):
+    depth: int
+    max_depth: int
+    dequeued: int
+    mean_wait: float
+    max_wait: float
+    last_wait: float
+
+
+class DispatchQueue:
+    """
+    Blocking FIFO between the socket reader and the manipulation thread. Consumers are woken up as soon as items
+    arrive and drain them in batches, the time every item spent in the queue is tracked (in seconds).
+    """
+
+    def __init__(self):
+        self.__items = deque()
+        self.__condition = threading.Condition()
+        self.__closed = False
+        self.__waiting = 0  # consumers that are done with their previous batch and wait for a new one
+
+        self.__max_depth = 0
+        self.__dequeued = 0
+        self.__total_wait = 0.0
+        self.__max_wait = 0.0
+        self.__last_wait = 0.0
+
+    def put_many(self, items: Iterable[Any]) -> None:
+        now = time.perf_counter()
+        with self.__condition:
+            self.__items.extend((now, item) for item in items)
+            self.__max_depth = max(self.__max_depth, len(self.__items))
+            self.__condition.notify()
+
+    def put(self, item: Any) -> None:
+        self.put_many((item,))
+
+    def get_batch(self, max_items: int = DEFAULT_BATCH_SIZE) -> list:
+        """
+        Blocks until at least one item is queued
+        :return: up to max_items items in FIFO order, or an empty list once the queue is closed
+        """
+        with self.__condition:
+            self.__waiting += 1
+            while len(self.__items) == 0 and not self.__closed:
+                self.__condition.wait()
+            self.__waiting -= 1
+            if self.__closed:
+                return []
+
+            batch = [self.__items.popleft() for _ in range(min(max_items, len(self.__items)))]
+
+            now = time.perf_counter()
+            for (queued_at, _) in batch:
+                wait = now - queued_at
+                self.__total_wait += wait
+                if wait > self.__max_wait:
+                    self.__max_wait = wait
+            self.__last_wait = now - batch[-1][0]
+            self.__dequeued += len(batch)
+
+        return [item for (_, item) in batch]
+
+    def close(self) -> None:
+        """
+        Wakes up all consumers, queued items are dropped
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__items.clear()
+            self.__condition.notify_all()
+
+    def is_idle(self) -> bool:
+        """
+        Whether every item that was put in the queue has been processed, with a single producer. Lock free: once the
+        queue was seen empty, only the producer itself could fill it, so a waiting consumer has nothing left to do.
+        """
+        return len(self.__items) == 0 and self.__waiting > 0
+
+    def is_closed(self) -> bool:
+        return self.__closed
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+    def metrics(self) -> QueueMetrics:
+        with self.__condition:
+            return {
+                'depth': len(self.__items),
+                'max_depth': self.__max_depth,
+                'dequeued': self.__dequeued,
+                'mean_wait': self.__total_wait / self.__dequeued if self.__dequeued > 0 else 0.0,
+                'max_wait': self.__max_wait,
+                'last_wait': self.__last_wait
+            }
+
+
+class InterceptTable:
+    """
+    Intercept listeners per direction, compiled into a flat header_id -> listeners table so dispatching a packet
+    is a single dict lookup. Names and hashes are resolved through the packet infos of the current connection,
+    the table is recompiled whenever those or the listeners change.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__sequence = 0
+        self.__packet_infos = None
+        self.__listeners = {Direction.TO_CLIENT: {}, Direction.TO_SERVER: {}}
+        self.__compiled = {Direction.TO_CLIENT: {}, Direction.TO_SERVER: {}}
+        self.__catch_all = {Direction.TO_CLIENT: (), Direction.TO_SERVER: ()}
+
+    def add(self, direction: Direction, identifier: int | str, callback: Callable[[HMessage], Any],
+            priority: int = 0, skip_if_blocked: bool = False) -> None:
+        with self.__lock:
+            self.__sequence += 1
+            self.__listeners[direction].setdefault(identifier, []) \
+                .append((priority, self.__sequence, callback, skip_if_blocked))
+            self.__compile()
+
+    def remove(self, identifier: int | str = -1) -> None:
+        """
+        Removes the listeners registered under identifier, or all of them when none is given
+        """
+        with self.__lock:
+            for listeners in self.__listeners.values():
+                if identifier == -1:
+                    listeners.clear()
+                elif identifier in listeners:
+                    del listeners[identifier]
+            self.__compile()
+
+    def compile(self, packet_infos: dict | None) -> None:
+        """
+        Resolves names and hashes against the packet infos of a (new) connection
+        """
+        with self.__lock:
+            self.__packet_infos = packet_infos
+            self.__compile()
+
+    def __resolve(self, direction: Direction, identifier: int | str) -> set[int]:
+        if type(identifier) is int:
+            return {identifier}
+        if self.__packet_infos is not None and identifier in self.__packet_infos[direction]:
+            return {elem['Id'] for elem in self.__packet_infos[direction][identifier]}
+        return set()
+
+    def __compile(self) -> None:
+        compiled = {}
+        catch_all = {}
+        for direction, listeners in self.__listeners.items():
+            # catch-all listeners run before specific ones of the same priority
+            catch_all_listeners = [(-priority, 0, sequence, callback, skip_if_blocked)
+                                   for (priority, sequence, callback, skip_if_blocked) in listeners.get(-1, [])]
+
+            per_header = {}
+            for identifier, identifier_listeners in listeners.items():
+                if identifier == -1:
+                    continue
+                for header_id in self.__resolve(direction, identifier):
+                    per_header.setdefault(header_id, list(catch_all_listeners)).extend(
+                        (-priority, 1, sequence, callback, skip_if_blocked)
+                        for (priority, sequence, callback, skip_if_blocked) in identifier_listeners)
+
+            compiled[direction] = {header_id: tuple((entry[3], entry[4]) for entry in sorted(entries))
+                                   for header_id, entries in per_header.items()}
+            catch_all[direction] = tuple((entry[3], entry[4]) for entry in sorted(catch_all_listeners))
+
+        self.__compiled = compiled
+        self.__catch_all = catch_all
+
+    def has_listeners(self, direction: Direction, header_id: int) -> bool:
+        return len(self.__compiled[direction].get(header_id, self.__catch_all[direction])) > 0
+
+    def listeners(self, direction: Direction, header_id: int) -> tuple[tuple[Callable[[HMessage], Any], bool], ...]:
+        """
+        :return: (callback, skip_if_blocked) pairs in the order they must be called
+        """
+        return self.__compiled[direction].get(header_id, self.__catch_all[direction])
+
+
+class OverflowPolicy(StrEnum):
+    BLOCK = 'block'
+    DROP = 'drop'
+    DROP_OLDEST = 'drop_oldest'
+    CALLER_RUNS = 'caller_runs'
+
+
+class WorkerPoolSettings(TypedDict):
+    max_workers: NotRequired[int]
+    queue_size: NotRequired[int]
+    overflow: NotRequired[OverflowPolicy]
+
+
+WORKER_POOL_DEFAULT: WorkerPoolSettings = {"max_workers": 16, "queue_size": 4096, "overflow": OverflowPolicy.BLOCK}
+
+
+class PoolMetrics(TypedDict):
+    workers: int
+    busy: int
+    queued: int
+    submitted: int
+    completed: int
+    rejected: int
+
+
+def reject(on_rejected: Callable[[], Any] | None) -> None:
+    if on_rejected is not None:
+        try:
+            on_rejected()
+        except Exception:
+            traceback.print_exc()
+
+
+class WorkerPool:
+    """
+    Fixed-size thread pool with a bounded queue, worker threads are started on demand. When the queue is full,
+    the overflow policy decides whether submit() waits for room (block), rejects the task (drop), evicts the
+    oldest queued task (drop_oldest) or runs the task on the calling thread (caller_runs).
+    A task that is evicted after submit() accepted it is handed to its on_rejected callback instead.
+    """
+
+    def __init__(self, settings: WorkerPoolSettings):
+        self.__max_workers = settings['max_workers']
+        self.__queue_size = settings['queue_size']
+        self.__overflow = OverflowPolicy(settings['overflow'])
+
+        self.__tasks = deque()
+        self.__lock = threading.Lock()
+        self.__not_empty = threading.Condition(self.__lock)
+        self.__not_full = threading.Condition(self.__lock)
+
+        self.__workers = 0
+        self.__busy = 0
+        self.__submitted = 0
+        self.__completed = 0
+        self.__rejected = 0
+
+    def __worker_thread(self) -> None:
+        while True:
+            with self.__lock:
+                while len(self.__tasks) == 0:
+                    self.__not_empty.wait()
+                func, args, _ = self.__tasks.popleft()
+                self.__busy += 1
+                self.__not_full.notify()
+
+            try:
+                func(*args)
+            except Exception:
+                traceback.print_exc()
+
+            with self.__lock:
+                self.__busy -= 1
+                self.__completed += 1
+
+    @property
+    def queue_size(self) -> int:
+        return self.__queue_size
+
+    @property
+    def overflow(self) -> OverflowPolicy:
+        return self.__overflow
+
+    def submit(self, func: Callable, *args, on_rejected: Callable[[], Any] | None = None) -> bool:
+        """
+        :param on_rejected: called when the accepted task is evicted by drop_oldest before it ran
+        :return: false if the task was rejected by the overflow policy
+        """
+        evicted = None
+        with self.__lock:
+            self.__submitted += 1
+
+            if len(self.__tasks) >= self.__queue_size:
+                if self.__overflow == OverflowPolicy.DROP:
+                    self.__rejected += 1
+                    return False
+                elif self.__overflow == OverflowPolicy.DROP_OLDEST:
+                    evicted = self.__tasks.popleft()[2]
+                    self.__rejected += 1
+                elif self.__overflow == OverflowPolicy.CALLER_RUNS:
+                    run_here = True
+                else:
+                    while len(self.__tasks) >= self.__queue_size:
+                        self.__not_full.wait()
+
+            if len(self.__tasks) < self.__queue_size:
+                run_here = False
+                self.__tasks.append((func, args, on_rejected))
+                self.__not_empty.notify()
+
+                if self.__busy + len(self.__tasks) > self.__workers and self.__workers < self.__max_workers:
+                    self.__workers += 1
+                    t = threading.Thread(target=self.__worker_thread, daemon=True)
+                    t.start()
+
+        if evicted is not None:
+            reject(evicted)
+
+        if run_here:
+            func(*args)
+            with self.__lock:
+                self.__completed += 1
+        return True
+
+    def metrics(self) -> PoolMetrics:
+        with self.__lock:
+            return {
+                'workers': self.__workers,
+                'busy': self.__busy,
+                'queued': len(self.__tasks),
+                'submitted': self.__submitted,
+                'completed': self.__completed,
+                'rejected': self.__rejected
+            }
+
+
+def header_lane_key(hmessage: HMessage) -> Hashable:
+    return hmessage.direction, hmessage.packet.header_id()
+
+
+class OrderedLanes:
+    """
+    Runs tasks on a WorkerPool, concurrently across lanes but strictly in submission order within a lane.
+    A lane only occupies a worker while it has pending tasks. Every lane is bounded by the queue size of the pool,
+    a full lane follows the overflow policy of the pool (caller_runs waits like block, to keep the order).
+    """
+
+    def __init__(self, pool: WorkerPool):
+        self.__pool = pool
+        self.__lock = threading.Lock()
+        self.__not_full = threading.Condition(self.__lock)
+        self.__lanes = {}
+
+    def __drain(self, key: Hashable) -> None:
+        while True:
+            with self.__lock:
+                lane = self.__lanes[key]
+                if len(lane) == 0:
+                    del self.__lanes[key]
+                    self.__not_full.notify_all()
+                    return
+                func, args, _ = lane[0]
+
+            try:
+                func(*args)
+            except Exception:
+                traceback.print_exc()
+
+            with self.__lock:
+                lane.popleft()
+                self.__not_full.notify_all()
+
+    def __release(self, key: Hashable) -> None:
+        """
+        The drain task of the lane was evicted from the pool before it ran, so nothing runs the lane anymore:
+        its tasks are rejected and the lane is removed
+        """
+        with self.__lock:
+            lane = self.__lanes.pop(key, ())
+            self.__not_full.notify_all()
+
+        for (_, _, on_rejected) in lane:
+            reject(on_rejected)
+
+    def submit(self, key: Hashable, func: Callable, *args, on_rejected: Callable[[], Any] | None = None) -> bool:
+        """
+        :param on_rejected: called when the accepted task is evicted by drop_oldest before it ran
+        :return: false if the task was rejected by the overflow policy of the pool
+        """
+        evicted = None
+        with self.__lock:
+            while True:
+                lane = self.__lanes.get(key)
+                # the head of a lane is the task that runs (or is about to), the rest is queued behind it
+                if lane is None or len(lane) <= self.__pool.queue_size:
+                    break
+                if self.__pool.overflow == OverflowPolicy.DROP:
+                    return False
+                if self.__pool.overflow == OverflowPolicy.DROP_OLDEST:
+                    evicted = lane[1][2]
+                    del lane[1]
+                    break
+                self.__not_full.wait()
+
+            if lane is not None:
+                lane.append((func, args, on_rejected))
+            else:
+                self.__lanes[key] = deque(((func, args, on_rejected),))
+
+        if evicted is not None:
+            reject(evicted)
+        if lane is not None:
+            return True
+
+        if self.__pool.submit(self.__drain, key, on_rejected=lambda: self.__release(key)):
+            return True
+
+        with self.__lock:
+            lane = self.__lanes[key]
+            lane.popleft()
+            if len(lane) == 0:
+                del self.__lanes[key]
+                self.__not_full.notify_all()
+                return False
+
+        # tasks were added to the lane in the meantime and still need to run
+        self.__drain(key)
+        return False
+
+    def pending(self) -> int:
+        """
+        :return: amount of tasks waiting in or being run by a lane
+        """
+        with self.__lock:
+            return sum(len(lane) for lane in self.__lanes.values())
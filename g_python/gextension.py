@@ -1,12 +1,19 @@
 import copy
 import socket
+import struct
 import sys
 import threading
+from collections import deque
+from concurrent.futures import Future
 from enum import IntEnum, StrEnum
-from typing import TypedDict, NotRequired, Callable
+from typing import TypedDict, NotRequired, Callable, Iterable
 
-from .hpacket import HPacket
-from .hmessage import HMessage, Direction
+from .hpacket import HPacket, PacketTemplate
+from .hexpression import PacketFormatter, packet_to_string, compile_expression
+from .hmessage import HMessage, Direction, peek_intercept
+from .gstream import FrameReader, FrameWriter, FlushPolicy, FLUSH_POLICY_DEFAULT
+from .gdispatch import DispatchQueue, QueueMetrics, InterceptTable, WorkerPool, WorkerPoolSettings, PoolMetrics, \
+    WORKER_POOL_DEFAULT, OrderedLanes, LaneKey, header_lane_key
 
 MINIMUM_GEARTH_VERSION: str = "1.4.1"
 
@@ -37,6 +44,7 @@ class InterceptMethod(StrEnum):
     DEFAULT = 'default'
     ASYNC = 'async'
     ASYNC_MODIFY = 'async_modify'
+    ASYNC_ORDERED = 'async_ordered'
 
 
 class ConsoleColour(StrEnum):
@@ -74,6 +82,12 @@ class ExtensionSettings(TypedDict):
     can_delete: NotRequired[bool]
 
 
+# packet length, header id, to server, habbo packet length
+SEND_MESSAGE_HEADER = struct.Struct('>ihBi')
+# packet length, header id, message length
+MANIPULATED_PACKET_HEADER = struct.Struct('>ihI')
+MANIPULATED_PACKET_ID = OutgoingMessages.MANIPULATED_PACKET.to_bytes(2, byteorder='big')
+
 EXTENSION_SETTINGS_DEFAULT: ExtensionSettings = {"use_click_trigger": False, "can_leave": True, "can_delete": True}
 EXTENSION_INFO_REQUIRED_FIELDS = ["title", "description", "version", "author"]
 
@@ -103,6 +117,146 @@ def get_argument(args: list[str], flags: list[str] | str):
     return None
 
 
+def read_extension_arguments(extension_info: ExtensionInfo, args: list[str]) -> tuple[int, str | None, str | None]:
+    """
+    Validates the extension info and reads the G-Earth arguments
+    :return: port, filename, auth cookie
+    """
+    if get_argument(args, PORT_FLAG) is None:
+        raise Exception('Port was not specified (argument example: -p 9092)')
+
+    for key in EXTENSION_INFO_REQUIRED_FIELDS:
+        if key not in extension_info:
+            raise Exception('Extension info error: {} field missing'.format(key))
+
+    return int(get_argument(args, PORT_FLAG)), get_argument(args, FILE_FLAG), get_argument(args, COOKIE_FLAG)
+
+
+def extension_info_packet(extension_info: ExtensionInfo, extension_settings: ExtensionSettings,
+                          file: str | None, cookie: str | None) -> HPacket:
+    return HPacket(OutgoingMessages.EXTENSION_INFO.value) \
+        .append_string(extension_info['title']) \
+        .append_string(extension_info['author']) \
+        .append_string(extension_info['version']) \
+        .append_string(extension_info['description']) \
+        .append_bool(extension_settings['use_click_trigger']) \
+        .append_bool(file is not None) \
+        .append_string('' if file is None else file) \
+        .append_string('' if cookie is None else cookie) \
+        .append_bool(extension_settings['can_leave']) \
+        .append_bool(extension_settings['can_delete'])
+
+
+def console_log_packet(extension_info: ExtensionInfo, text, color: ConsoleColour, mention_title: bool) -> HPacket:
+    message = '[{}]{}{}'.format(color, (extension_info['title'] + ' --> ') if mention_title else '', text)
+    return HPacket(OutgoingMessages.EXTENSION_CONSOLE_LOG.value, message)
+
+
+def parse_packet_infos(packet: HPacket) -> dict[Direction, dict[int | str, list[dict]]]:
+    incoming = {}
+    outgoing = {}
+
+    length = packet.read_int()
+    for _ in range(length):
+        header_id, hash_code, name, structure, is_outgoing, source = packet.read('isssBs')
+        name = name if name != 'NULL' else None
+        hash_code = hash_code if hash_code != 'NULL' else None
+        structure = structure if structure != 'NULL' else None
+
+        elem = {'Id': header_id, 'Name': name, 'Hash': hash_code, 'Structure': structure, 'Source': source}
+
+        packet_dict = outgoing if is_outgoing else incoming
+        if header_id not in packet_dict:
+            packet_dict[header_id] = []
+        packet_dict[header_id].append(elem)
+
+        if hash_code is not None:
+            if hash_code not in packet_dict:
+                packet_dict[hash_code] = []
+            packet_dict[hash_code].append(elem)
+
+        if name is not None:
+            if name not in packet_dict:
+                packet_dict[name] = []
+            packet_dict[name].append(elem)
+
+    return {Direction.TO_CLIENT: incoming, Direction.TO_SERVER: outgoing}
+
+
+def send_message_buffers(direction: Direction, packet: HPacket, extension) \
+        -> tuple[bytes, bytes | bytearray | memoryview] | None:
+    """
+    Builds the SEND_MESSAGE header for a habbo packet, filling in the header id if it was given by name
+    :return: header and payload buffers to be written right away, or None if the packet can't be sent
+    """
+    old_settings = None
+    if packet.is_incomplete_packet():
+        old_settings = (packet.header_id(), packet.is_edited, packet.incomplete_identifier)
+        packet.fill_id(direction, extension)
+
+    buffers = None
+    if extension.connection_info is None:
+        print("Could not send packet because G-Earth isn't connected to a client", file=sys.stderr)
+    elif packet.is_corrupted():
+        print('Could not send corrupted', file=sys.stderr)
+    elif packet.is_incomplete_packet():
+        print('Could not send incomplete packet', file=sys.stderr)
+    else:
+        payload = packet.buffer()
+        header = SEND_MESSAGE_HEADER.pack(SEND_MESSAGE_HEADER.size - 4 + len(payload), OutgoingMessages.SEND_MESSAGE,
+                                          direction == Direction.TO_SERVER, len(payload))
+        # the payload is only copied if the packet is about to be changed back
+        buffers = (header, payload if old_settings is None else bytes(payload))
+
+    if old_settings is not None:
+        packet.replace_short(4, old_settings[0])
+        packet.incomplete_identifier = old_settings[2]
+        packet.is_edited = old_settings[1]
+
+    return buffers
+
+
+def template_message_buffers(template: PacketTemplate, values: tuple, extension) \
+        -> tuple[bytes, bytes] | None:
+    """
+    Packs a templated habbo packet straight into SEND_MESSAGE buffers
+    :return: header and payload buffers, or None if the packet can't be sent
+    """
+    if extension.connection_info is None:
+        print("Could not send packet because G-Earth isn't connected to a client", file=sys.stderr)
+        return None
+
+    payload = template.pack(*values, extension=extension)
+    if payload is None:
+        print('Could not send incomplete packet', file=sys.stderr)
+        return None
+
+    return SEND_MESSAGE_HEADER.pack(SEND_MESSAGE_HEADER.size - 4 + len(payload), OutgoingMessages.SEND_MESSAGE,
+                                    template.direction == Direction.TO_SERVER, len(payload)), payload
+
+
+def manipulated_packet_buffers(habbo_message: HMessage) \
+        -> tuple[bytes, bytes | bytearray, bytes | bytearray | memoryview]:
+    """
+    Builds the MANIPULATED_PACKET response for an intercepted message without a string round-trip
+    :return: header, message metadata and packet buffers
+    """
+    meta, payload = habbo_message.java_buffers()
+    length = len(meta) + len(payload)
+    header = MANIPULATED_PACKET_HEADER.pack(MANIPULATED_PACKET_HEADER.size - 4 + length,
+                                            OutgoingMessages.MANIPULATED_PACKET, length)
+    return header, meta, payload
+
+
+def echo_intercept_buffers(frame: bytes | bytearray) -> tuple[memoryview, bytes, memoryview]:
+    """
+    Builds the MANIPULATED_PACKET response that lets an intercepted packet pass unchanged, which is the intercept
+    packet itself with another header id
+    """
+    view = memoryview(frame)
+    return view[:4], MANIPULATED_PACKET_ID, view[6:]
+
+
 def run_callbacks(callbacks: list[Callable[[], None]]) -> None:
     for func in callbacks:
         func()
@@ -110,27 +264,34 @@ def run_callbacks(callbacks: list[Callable[[], None]]) -> None:
 
 class Extension:
     def __init__(self, extension_info: ExtensionInfo, args: list[str],
-                 extension_settings: None | ExtensionSettings = None, silent: bool = False):
+                 extension_settings: None | ExtensionSettings = None, silent: bool = False,
+                 flush_policy: None | FlushPolicy = None, worker_pool: None | WorkerPoolSettings = None):
+        """
+        :param flush_policy: when to flush packets sent to the client/server, by default every packet is written
+                             right away. {"batch_size": 32, "max_delay": 0.005} coalesces up to 32 packets that
+                             are sent within 5 ms of each other into a single write
+        :param worker_pool: threads running async intercepts and event callbacks, by default up to 16 workers with
+                            4096 queued tasks. overflow decides what happens to tasks when the queue is full:
+                            block (wait for room), drop, drop_oldest or caller_runs
+        """
         if not silent:
             print("WARNING: This version of G-Python requires G-Earth >= {}".format(MINIMUM_GEARTH_VERSION),
                   file=sys.stderr)
             print("abc")
 
         extension_settings = fill_settings(extension_settings, EXTENSION_SETTINGS_DEFAULT)
+        self.__flush_policy = fill_settings(flush_policy, FLUSH_POLICY_DEFAULT)
+        self.__worker_pool = WorkerPool(fill_settings(worker_pool, WORKER_POOL_DEFAULT))
+        self.__lanes = OrderedLanes(self.__worker_pool)
 
-        if get_argument(args, PORT_FLAG) is None:
-            raise Exception('Port was not specified (argument example: -p 9092)')
-
-        for key in EXTENSION_INFO_REQUIRED_FIELDS:
-            if key not in extension_info:
-                raise Exception('Extension info error: {} field missing'.format(key))
-
-        port = int(get_argument(args, PORT_FLAG))
-        file = get_argument(args, FILE_FLAG)
-        cookie = get_argument(args, COOKIE_FLAG)
+        port, file, cookie = read_extension_arguments(extension_info, args)
 
         self.__sock = None
+        self.__reader = None
+        self.__writer = None
         self.__lost_packets = 0
+        self.__bypassed_packets = 0
+        self.__intercepted_packets = 0
 
         self._extension_info = extension_info
         self.__port = port
@@ -140,244 +301,171 @@ class Extension:
 
         self.connection_info = None
         self.packet_infos = None
+        self.__formatter = PacketFormatter(None)
 
         self.__start_barrier = threading.Barrier(2)
         self.__start_lock = threading.Lock()
-        self.__stream_lock = threading.Lock()
 
         self.__events = {}
-        self.__intercept_listeners = {Direction.TO_CLIENT: {-1: []}, Direction.TO_SERVER: {-1: []}}
+        self.__intercept_table = InterceptTable()
 
         self.__request_lock = threading.Lock()
-        self.__response_barrier = threading.Barrier(2)
-        self.__response = None
-
-        self.__manipulation_lock = threading.Lock()
-        self.__manipulation_event = threading.Event()
-        self.__manipulate_messages = []
-
-    def __read_gearth_packet(self) -> HPacket:
-        write_pos = 0
-
-        length_buffer = bytearray(4)
-        while write_pos < 4:
-            n_read = self.__sock.recv_into(memoryview(length_buffer)[write_pos:])
-            if n_read == 0:
-                raise EOFError
-            write_pos += n_read
-
-        packet_length = int.from_bytes(length_buffer, byteorder='big')
-        packet_buffer = length_buffer + bytearray(packet_length)
-
-        while write_pos < 4 + packet_length:
-            n_read = self.__sock.recv_into(memoryview(packet_buffer)[write_pos:])
-            if n_read == 0:
-                raise EOFError
-            write_pos += n_read
-
-        return HPacket.from_bytes(packet_buffer)
-
-    def __packet_manipulation_thread(self) -> None:
-        while not self.is_closed():
-            habbo_message = None
-            while habbo_message is None and not self.is_closed():
-                if len(self.__manipulate_messages) > 0:
-                    self.__manipulation_lock.acquire()
-                    habbo_message = self.__manipulate_messages.pop(0)
-                    self.__manipulation_lock.release()
-                    self.__manipulation_event.clear()
-                else:
-                    self.__manipulation_event.wait(0.002)
-                    self.__manipulation_event.clear()
-
-            if self.is_closed():
-                return
-
-            habbo_packet = habbo_message.packet
-            habbo_packet.default_extension = self
-
-            for func in self.__intercept_listeners[habbo_message.direction][-1]:
-                func(habbo_message)
-                habbo_packet.reset()
-
-            header_id = habbo_packet.header_id()
-            potential_intercept_ids = {header_id}
-            if self.packet_infos is not None and header_id in self.packet_infos[habbo_message.direction]:
-                for elem in self.packet_infos[habbo_message.direction][header_id]:
-                    if elem['Name'] is not None:
-                        potential_intercept_ids.add(elem['Name'])
-                    if elem['Hash'] is not None:
-                        potential_intercept_ids.add(elem['Hash'])
-
-            for identifier in potential_intercept_ids:
-                if identifier in self.__intercept_listeners[habbo_message.direction]:
-                    for func in self.__intercept_listeners[habbo_message.direction][identifier]:
-                        func(habbo_message)
-                        habbo_packet.reset()
-
-            response_packet = HPacket(OutgoingMessages.MANIPULATED_PACKET.value)
-            response_packet.append_string(repr(habbo_message), head=4, encoding='iso-8859-1')
-            self.__send_to_stream(response_packet)
+        self.__responses = {
+            IncomingMessages.FLAGS_CHECK: deque(),
+            IncomingMessages.PACKET_TO_STRING_RESPONSE: deque(),
+            IncomingMessages.STRING_TO_PACKET_RESPONSE: deque()
+        }
+
+        self.__manipulate_messages = DispatchQueue()
+
+    def __packet_manipulation_thread(self, messages: DispatchQueue, writer: FrameWriter) -> None:
+        # bound to the queue and writer of its own connection, so it can't pick up packets after a restart
+        while not messages.is_closed():
+            for habbo_message in messages.get_batch():
+                if messages.is_closed():
+                    return
+                self.__manipulate_packet(habbo_message, writer)
+
+    def __manipulate_packet(self, habbo_message: HMessage, writer: FrameWriter) -> None:
+        habbo_packet = habbo_message.packet
+        habbo_packet.extension = self
+
+        for (func, skip_if_blocked) in self.__intercept_table.listeners(habbo_message.direction,
+                                                                       habbo_packet.header_id()):
+            if skip_if_blocked and habbo_message.is_blocked:
+                continue
+            func(habbo_message)
+            habbo_packet.reset()
+
+        writer.write_now(*manipulated_packet_buffers(habbo_message))
+
+    def __queue_intercepted(self, messages: DispatchQueue, habbo_messages: list[HMessage]) -> None:
+        if len(habbo_messages) > 0:
+            messages.put_many(habbo_messages)
+            habbo_messages.clear()
 
     def __connection_thread(self) -> None:
-        t = threading.Thread(target=self.__packet_manipulation_thread)
+        messages = self.__manipulate_messages
+        t = threading.Thread(target=self.__packet_manipulation_thread, args=(messages, self.__writer))
         t.start()
 
+        intercepted = []
         while not self.is_closed():
             try:
-                packet = self.__read_gearth_packet()
-            except EOFError:
+                packets = self.__reader.read_packets()
+            except (EOFError, OSError):
                 if not self.is_closed():
                     self.stop()
+                self.__fail_responses()
+                return
+
+            for packet in packets:
+                if packet.header_id() == IncomingMessages.PACKET_INTERCEPT:
+                    frame = packet.buffer()
+                    self.__intercepted_packets += 1
+                    # packets nobody listens to are answered right away, unless that would overtake others
+                    if len(intercepted) == 0 and messages.is_idle() \
+                            and not self.__intercept_table.has_listeners(*peek_intercept(frame)):
+                        self.__writer.write_now(*echo_intercept_buffers(frame))
+                        self.__bypassed_packets += 1
+                    else:
+                        intercepted.append(HMessage.from_intercept(frame))
+                else:
+                    # keep intercepted packets ahead of anything that might block on a response
+                    self.__queue_intercepted(messages, intercepted)
+                    self.__handle_gearth_packet(packet)
+
+            self.__queue_intercepted(messages, intercepted)
+
+    def __handle_gearth_packet(self, packet: HPacket) -> None:
+        message_type = IncomingMessages(packet.header_id())
+        if message_type == IncomingMessages.INFO_REQUEST:
+            response = extension_info_packet(self._extension_info, self._extension_settings, self.__file,
+                                             self.__cookie)
+            self.__send_to_stream(response)
+
+        elif message_type == IncomingMessages.CONNECTION_START:
+            host, port, hotel_version, client_identifier, client_type = packet.read("sisss")
+            self.packet_infos = parse_packet_infos(packet)
+            self.__intercept_table.compile(self.packet_infos)
+            self.__formatter = PacketFormatter(self.packet_infos)
+
+            self.connection_info = {'host': host, 'port': port, 'hotel_version': hotel_version,
+                                    'client_identifier': client_identifier, 'client_type': client_type}
+
+            self.__raise_event('connection_start')
+
+            if self.__await_connect_packet:
+                self.__await_connect_packet = False
+                self.__start_barrier.wait()
+
+        elif message_type == IncomingMessages.CONNECTION_END:
+            self.__raise_event('connection_end')
+            self.connection_info = None
+            self.packet_infos = None
+            self.__intercept_table.compile(None)
+            self.__formatter = PacketFormatter(None)
+
+        elif message_type == IncomingMessages.FLAGS_CHECK:
+            size = packet.read_int()
+            flags = [packet.read_string() for _ in range(size)]
+            self.__resolve_response(message_type, flags)
+
+        elif message_type == IncomingMessages.INIT:
+            self.__raise_event('init')
+            self.write_to_console(
+                'g_python extension "{}" sucessfully initialized'.format(self._extension_info['title']),
+                ConsoleColour.GREEN,
+                False
+            )
+
+            self.__await_connect_packet = packet.read_bool()
+            if not self.__await_connect_packet:
+                self.__start_barrier.wait()
+
+        elif message_type == IncomingMessages.ON_DOUBLE_CLICK:
+            self.__raise_event('double_click')
+
+        elif message_type == IncomingMessages.PACKET_TO_STRING_RESPONSE:
+            string = packet.read_string(head=4, encoding='iso-8859-1')
+            expression = packet.read_string(head=4, encoding='utf-8')
+            self.__resolve_response(message_type, (string, expression))
+
+        elif message_type == IncomingMessages.STRING_TO_PACKET_RESPONSE:
+            packet_string = packet.read_string(head=4, encoding='iso-8859-1')
+            self.__resolve_response(message_type, HPacket.reconstruct_from_java(packet_string))
+
+    def __resolve_response(self, message_type: IncomingMessages, response) -> None:
+        with self.__request_lock:
+            futures = self.__responses[message_type]
+            if len(futures) == 0:
                 return
+            future, transform = futures.popleft()
+        future.set_result(response if transform is None else transform(response))
 
-            message_type = IncomingMessages(packet.header_id())
-            if message_type == IncomingMessages.INFO_REQUEST:
-                response = HPacket(OutgoingMessages.EXTENSION_INFO.value)
-                response \
-                    .append_string(self._extension_info['title']) \
-                    .append_string(self._extension_info['author']) \
-                    .append_string(self._extension_info['version']) \
-                    .append_string(self._extension_info['description']) \
-                    .append_bool(self._extension_settings['use_click_trigger']) \
-                    .append_bool(self.__file is not None) \
-                    .append_string('' if self.__file is None else self.__file) \
-                    .append_string('' if self.__cookie is None else self.__cookie) \
-                    .append_bool(self._extension_settings['can_leave']) \
-                    .append_bool(self._extension_settings['can_delete'])
-
-                self.__send_to_stream(response)
-
-            elif message_type == IncomingMessages.CONNECTION_START:
-                host, port, hotel_version, client_identifier, client_type = packet.read("sisss")
-                self.__parse_packet_infos(packet)
-
-                self.connection_info = {'host': host, 'port': port, 'hotel_version': hotel_version,
-                                        'client_identifier': client_identifier, 'client_type': client_type}
-
-                self.__raise_event('connection_start')
-
-                if self.__await_connect_packet:
-                    self.__await_connect_packet = False
-                    self.__start_barrier.wait()
-
-            elif message_type == IncomingMessages.CONNECTION_END:
-                self.__raise_event('connection_end')
-                self.connection_info = None
-                self.packet_infos = None
-
-            elif message_type == IncomingMessages.FLAGS_CHECK:
-                size = packet.read_int()
-                flags = [packet.read_string() for _ in range(size)]
-                self.__response = flags
-                self.__response_barrier.wait()
-
-            elif message_type == IncomingMessages.INIT:
-                self.__raise_event('init')
-                self.write_to_console(
-                    'g_python extension "{}" sucessfully initialized'.format(self._extension_info['title']),
-                    ConsoleColour.GREEN,
-                    False
-                )
-
-                self.__await_connect_packet = packet.read_bool()
-                if not self.__await_connect_packet:
-                    self.__start_barrier.wait()
-
-            elif message_type == IncomingMessages.ON_DOUBLE_CLICK:
-                self.__raise_event('double_click')
-
-            elif message_type == IncomingMessages.PACKET_INTERCEPT:
-                habbo_msg_as_string = packet.read_string(head=4, encoding='iso-8859-1')
-                habbo_message = HMessage.reconstruct_from_java(habbo_msg_as_string)
-                self.__manipulation_lock.acquire()
-                self.__manipulate_messages.append(habbo_message)
-                self.__manipulation_lock.release()
-                self.__manipulation_event.set()
-
-            elif message_type == IncomingMessages.PACKET_TO_STRING_RESPONSE:
-                string = packet.read_string(head=4, encoding='iso-8859-1')
-                expression = packet.read_string(head=4, encoding='utf-8')
-                self.__response = (string, expression)
-                self.__response_barrier.wait()
-
-            elif message_type == IncomingMessages.STRING_TO_PACKET_RESPONSE:
-                packet_string = packet.read_string(head=4, encoding='iso-8859-1')
-                self.__response = HPacket.reconstruct_from_java(packet_string)
-                self.__response_barrier.wait()
-
-    def __parse_packet_infos(self, packet: HPacket) -> None:
-        incoming = {}
-        outgoing = {}
-
-        length = packet.read_int()
-        for _ in range(length):
-            header_id, hash_code, name, structure, is_outgoing, source = packet.read('isssBs')
-            name = name if name != 'NULL' else None
-            hash_code = hash_code if hash_code != 'NULL' else None
-            structure = structure if structure != 'NULL' else None
-
-            elem = {'Id': header_id, 'Name': name, 'Hash': hash_code, 'Structure': structure, 'Source': source}
-
-            packet_dict = outgoing if is_outgoing else incoming
-            if header_id not in packet_dict:
-                packet_dict[header_id] = []
-            packet_dict[header_id].append(elem)
-
-            if hash_code is not None:
-                if hash_code not in packet_dict:
-                    packet_dict[hash_code] = []
-                packet_dict[hash_code].append(elem)
-
-            if name is not None:
-                if name not in packet_dict:
-                    packet_dict[name] = []
-                packet_dict[name].append(elem)
-
-        self.packet_infos = {Direction.TO_CLIENT: incoming, Direction.TO_SERVER: outgoing}
+    def __fail_responses(self) -> None:
+        with self.__request_lock:
+            pending = [future for futures in self.__responses.values() for (future, _) in futures]
+            for futures in self.__responses.values():
+                futures.clear()
+        for future in pending:
+            future.set_exception(ConnectionError('Connection with G-Earth was closed'))
 
     def __send_to_stream(self, packet: HPacket) -> None:
-        self.__stream_lock.acquire()
-        self.__sock.send(packet.bytearray)
-        self.__stream_lock.release()
+        self.__writer.write_now(packet.buffer())
 
     def __raise_event(self, event_name: str) -> None:
         if event_name in self.__events:
-            t = threading.Thread(target=run_callbacks, args=(self.__events[event_name],))
-            t.start()
+            self.__worker_pool.submit(run_callbacks, list(self.__events[event_name]))
 
     def __send(self, direction: Direction, packet: HPacket) -> bool:
         if not self.is_closed():
-
-            old_settings = None
-            if packet.is_incomplete_packet():
-                old_settings = (packet.header_id(), packet.is_edited, packet.incomplete_identifier)
-                packet.fill_id(direction, self)
-
-            if self.connection_info is None:
+            buffers = send_message_buffers(direction, packet, self)
+            if buffers is None:
                 self.__lost_packets += 1
-                print("Could not send packet because G-Earth isn't connected to a client", file=sys.stderr)
                 return False
 
-            if packet.is_corrupted():
-                self.__lost_packets += 1
-                print('Could not send corrupted', file=sys.stderr)
-                return False
-
-            if packet.is_incomplete_packet():
-                self.__lost_packets += 1
-                print('Could not send incomplete packet', file=sys.stderr)
-                return False
-
-            wrapper_packet = HPacket(OutgoingMessages.SEND_MESSAGE.value, direction == Direction.TO_SERVER,
-                                     len(packet.bytearray), bytes(packet.bytearray))
-            self.__send_to_stream(wrapper_packet)
-
-            if old_settings is not None:
-                packet.replace_short(4, old_settings[0])
-                packet.incomplete_identifier = old_settings[2]
-                packet.is_edited = old_settings[1]
-
+            self.__writer.write(*buffers)
             return True
         else:
             self.__lost_packets += 1
@@ -389,6 +477,30 @@ class Extension:
         """
         return self.__sock is None or self.__sock.fileno() == -1
 
+    def queue_metrics(self) -> QueueMetrics:
+        """
+        :return: depth of the intercepted packet queue and the time packets spent waiting in it (in seconds)
+        """
+        return self.__manipulate_messages.metrics()
+
+    def bypassed_packets(self) -> int:
+        """
+        :return: amount of intercepted packets without listeners that were answered straight from the reader
+        """
+        return self.__bypassed_packets
+
+    def intercepted_packets(self) -> int:
+        """
+        :return: amount of packets G-Earth passed to the extension, bypassed or not
+        """
+        return self.__intercepted_packets
+
+    def pool_metrics(self) -> PoolMetrics:
+        """
+        :return: size, queue depth and rejection count of the worker pool running async intercepts and events
+        """
+        return self.__worker_pool.metrics()
+
     def send_to_client(self, packet: HPacket | str) -> bool:
         """
         Sends a message to the client
@@ -396,7 +508,7 @@ class Extension:
         """
 
         if type(packet) is str:
-            packet = self.string_to_packet(packet)
+            packet = self.__string_to_packet(packet, Direction.TO_CLIENT)
         return self.__send(Direction.TO_CLIENT, packet)
 
     def send_to_server(self, packet: HPacket | str) -> bool:
@@ -406,9 +518,57 @@ class Extension:
         """
 
         if type(packet) is str:
-            packet = self.string_to_packet(packet)
+            packet = self.__string_to_packet(packet, Direction.TO_SERVER)
         return self.__send(Direction.TO_SERVER, packet)
 
+    def send_template(self, template: PacketTemplate, *values: int | str | bool) -> bool:
+        """
+        Sends a packet built from a PacketTemplate, in the direction of the template
+        :param values: one value per type in the structure of the template
+        """
+        if self.is_closed():
+            self.__lost_packets += 1
+            return False
+
+        buffers = template_message_buffers(template, values, self)
+        if buffers is None:
+            self.__lost_packets += 1
+            return False
+
+        self.__writer.write(*buffers)
+        return True
+
+    def send_many(self, direction: Direction, packets: Iterable[HPacket | str]) -> int:
+        """
+        Sends a burst of messages in a single write
+        :param direction: Direction.TO_CLIENT or Direction.TO_SERVER
+        :param packets: HPacket() objects or string representations
+        :return: amount of packets that were sent
+        """
+        if self.is_closed():
+            return 0
+
+        buffers = []
+        for packet in packets:
+            if type(packet) is str:
+                packet = self.__string_to_packet(packet, direction)
+            packet_buffers = send_message_buffers(direction, packet, self)
+            if packet_buffers is None:
+                self.__lost_packets += 1
+            else:
+                buffers.extend(packet_buffers)
+
+        if len(buffers) > 0:
+            self.__writer.write(*buffers, frames=len(buffers) // 2)
+        return len(buffers) // 2
+
+    def flush(self) -> None:
+        """
+        Writes out packets that are held back by the flush policy
+        """
+        if not self.is_closed():
+            self.__writer.flush()
+
     def on_event(self, event_name: str, func: Callable) -> None:
         """
         implemented event names: double_click, connection_start, connection_end,init. When this
@@ -420,7 +580,8 @@ class Extension:
             self.__events[event_name] = [func]
 
     def intercept(self, direction: Direction, callback: Callable[[HMessage], None], identifier: int | str = -1,
-                  mode: InterceptMethod = InterceptMethod.DEFAULT) -> None:
+                  mode: InterceptMethod = InterceptMethod.DEFAULT, priority: int = 0,
+                  skip_if_blocked: bool = False, lane_key: None | LaneKey = None) -> None:
         """
         :param direction: Direction.TOCLIENT or Direction.TOSERVER
         :param callback: function that takes HMessage as an argument
@@ -428,6 +589,12 @@ class Extension:
         :param mode: can be: * default (blocking)
                              * async (async, can't modify packet, doesn't disturb packet flow)
                              * async_modify (async, can modify, doesn't block other packets, disturbs packet flow)
+                             * async_ordered (like async_modify, but packets in the same lane are handled and
+                                              sent one after another, in the order they were intercepted)
+        :param priority: listeners with a higher priority are called first
+        :param skip_if_blocked: don't call this listener for packets blocked by an earlier listener
+        :param lane_key: async_ordered only, function that maps a HMessage to its lane. By default every
+                         direction + header id is a lane
         :return:
         """
         original_callback = callback
@@ -435,8 +602,7 @@ class Extension:
         if mode == 'async':
             def new_callback(hmessage: HMessage) -> None:
                 copied = copy.copy(hmessage)
-                t = threading.Thread(target=original_callback, args=[copied])
-                t.start()
+                self.__worker_pool.submit(original_callback, copied)
 
             callback = new_callback
 
@@ -447,31 +613,40 @@ class Extension:
                     self.__send(hmessage.direction, hmessage.packet)
 
             def new_callback(hmessage: HMessage) -> None:
-                hmessage.is_blocked = True
                 copied = copy.copy(hmessage)
                 copied.is_blocked = False
-                t = threading.Thread(target=callback_send, args=[copied])
-                t.start()
+                # a rejected task lets the original packet through instead of losing it, a task that is evicted
+                # later on sends the packet unchanged
+                if self.__worker_pool.submit(callback_send, copied,
+                                             on_rejected=lambda: self.__send(copied.direction, copied.packet)):
+                    hmessage.is_blocked = True
 
             callback = new_callback
 
-        if identifier not in self.__intercept_listeners[direction]:
-            self.__intercept_listeners[direction][identifier] = []
-        self.__intercept_listeners[direction][identifier].append(callback)
+        if mode == 'async_ordered':
+            key_function = header_lane_key if lane_key is None else lane_key
+
+            def callback_send(hmessage: HMessage) -> None:
+                original_callback(hmessage)
+                if not hmessage.is_blocked:
+                    self.__send(hmessage.direction, hmessage.packet)
+
+            def new_callback(hmessage: HMessage) -> None:
+                copied = copy.copy(hmessage)
+                copied.is_blocked = False
+                if self.__lanes.submit(key_function(hmessage), callback_send, copied,
+                                       on_rejected=lambda: self.__send(copied.direction, copied.packet)):
+                    hmessage.is_blocked = True
+
+            callback = new_callback
+
+        self.__intercept_table.add(direction, identifier, callback, priority, skip_if_blocked)
 
     def remove_intercept(self, intercept_id: int | str = -1) -> None:
         """
         Clear intercepts per id or all of them when none is given
         """
-
-        if intercept_id == -1:
-            for direction in self.__intercept_listeners:
-                for identifier in self.__intercept_listeners[direction]:
-                    del self.__intercept_listeners[direction][identifier]
-        else:
-            for direction in self.__intercept_listeners:
-                if intercept_id in self.__intercept_listeners[direction]:
-                    del self.__intercept_listeners[direction][intercept_id]
+        self.__intercept_table.remove(intercept_id)
 
     def start(self) -> None:
         """
@@ -482,6 +657,9 @@ class Extension:
             self.__sock = socket.socket()
             self.__sock.connect(("127.0.0.1", self.__port))
             self.__sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.__reader = FrameReader(self.__sock)
+            self.__writer = FrameWriter(self.__sock, self.__flush_policy)
+            self.__manipulate_messages = DispatchQueue()
             t = threading.Thread(target=self.__connection_thread)
             t.start()
             self.__start_barrier.wait()
@@ -496,6 +674,8 @@ class Extension:
         """
         if not self.is_closed():
             self.__sock.close()
+            self.__writer.close()
+            self.__manipulate_messages.close()
         else:
             raise Exception("Attempted to close extension that wasn't running")
 
@@ -503,36 +683,76 @@ class Extension:
         """
         Writes a message to the G-Earth console
         """
-        message = '[{}]{}{}'.format(color, (self._extension_info['title'] + ' --> ') if mention_title else '', text)
-        packet = HPacket(OutgoingMessages.EXTENSION_CONSOLE_LOG.value, message)
-        self.__send_to_stream(packet)
+        self.__send_to_stream(console_log_packet(self._extension_info, text, color, mention_title))
 
-    def __await_response(self, request: HPacket) -> str | list[str] | HPacket:
-        self.__request_lock.acquire()
-        self.__send_to_stream(request)
-        self.__response_barrier.wait()
-        result = self.__response
-        self.__response = None
-        self.__request_lock.release()
-        return result
+    def __request(self, request: HPacket, message_type: IncomingMessages,
+                  transform: None | Callable = None) -> Future:
+        future = Future()
+        # G-Earth answers requests of the same kind in order, so responses are matched first come first served
+        with self.__request_lock:
+            if self.is_closed():
+                raise ConnectionError('Extension is not connected with G-Earth')
+            self.__responses[message_type].append((future, transform))
+            self.__send_to_stream(request)
+        return future
 
-    def packet_to_string(self, packet: HPacket) -> str:
-        request = HPacket(OutgoingMessages.PACKET_TO_STRING_REQUEST.value)
-        request.append_string(repr(packet), 4, 'iso-8859-1')
+    def packet_to_string_async(self, packet: HPacket) -> Future[str]:
+        future = Future()
+        future.set_result(packet_to_string(packet))
+        return future
 
-        return self.__await_response(request)[0]
+    def packet_to_expression_async(self, packet: HPacket, direction: Direction | None = None) -> Future[str]:
+        """
+        Non-blocking packet_to_expression, any amount of requests can be in flight at the same time
+        :return: a Future that resolves to the expression
+        """
+        expression = self.__formatter.to_expression(packet, direction)
+        if expression is not None:
+            future = Future()
+            future.set_result(expression)
+            return future
 
-    def packet_to_expression(self, packet: HPacket) -> str:
         request = HPacket(OutgoingMessages.PACKET_TO_STRING_REQUEST.value)
         request.append_string(repr(packet), 4, 'iso-8859-1')
 
-        return self.__await_response(request)[1]
+        return self.__request(request, IncomingMessages.PACKET_TO_STRING_RESPONSE, lambda response: response[1])
 
-    def string_to_packet(self, string: str) -> HPacket:
+    def __string_to_packet(self, string: str, direction: Direction | None) -> HPacket:
+        template = compile_expression(string)
+        packet = None if template is None else template.to_packet(direction, self.packet_infos)
+        return packet if packet is not None else self.string_to_packet_async(string).result()
+
+    def string_to_packet_async(self, string: str) -> Future[HPacket]:
+        """
+        Asks G-Earth to convert a string or expression to a packet, any amount of requests can be in flight
+        """
         request = HPacket(OutgoingMessages.STRING_TO_PACKET_REQUEST.value)
         request.append_string(string, 4)
 
-        return self.__await_response(request)
+        return self.__request(request, IncomingMessages.STRING_TO_PACKET_RESPONSE)
+
+    def packet_to_string(self, packet: HPacket) -> str:
+        """
+        Renders the G-Earth string representation of a packet locally
+        """
+        return packet_to_string(packet)
+
+    def packet_to_expression(self, packet: HPacket, direction: Direction | None = None) -> str:
+        """
+        Renders the expression locally when the structure of the packet is known, otherwise asks G-Earth
+        :param direction: resolves header ids that exist in both directions
+        """
+        return self.packet_to_expression_async(packet, direction).result()
+
+    def packets_to_strings(self, packets: Iterable[HPacket]) -> list[str]:
+        return [packet_to_string(packet) for packet in packets]
+
+    def string_to_packet(self, string: str) -> HPacket:
+        """
+        Expressions like {out:MoveAvatar}{i:3}{i:5} are compiled locally (and cached), anything else is converted
+        by G-Earth
+        """
+        return self.__string_to_packet(string, None)
 
     def request_flags(self) -> list[str]:
-        return self.__await_response(HPacket(OutgoingMessages.REQUEST_FLAGS.value))
+        return self.__request(HPacket(OutgoingMessages.REQUEST_FLAGS.value), IncomingMessages.FLAGS_CHECK).result()
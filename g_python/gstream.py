@@ -0,0 +1,209 @@
+import socket
+import threading
+import time
+from typing import TypedDict, NotRequired
+
+from .hpacket import HPacket
+
+DEFAULT_READ_BUFFER_SIZE: int = 1 << 16
+MAX_IOV: int = 512
+
+
+class FrameReader:
+    """
+    Buffered reader for the length-prefixed G-Earth socket protocol. Every recv pulls in as much data as
+    the socket has available, after which all complete frames in the buffer are sliced out at once.
+    """
+
+    def __init__(self, sock: socket.socket, buffer_size: int = DEFAULT_READ_BUFFER_SIZE):
+        self.__sock = sock
+        self.__buffer = bytearray(buffer_size)
+        self.__view = memoryview(self.__buffer)
+        self.__read_pos = 0
+        self.__write_pos = 0
+
+    def __pending_frame_size(self) -> int:
+        pending = self.__write_pos - self.__read_pos
+        if pending < 4:
+            return 4
+        return 4 + int.from_bytes(self.__view[self.__read_pos:self.__read_pos + 4], byteorder='big')
+
+    def __make_room(self) -> None:
+        pending = self.__write_pos - self.__read_pos
+        if self.__read_pos > 0:
+            # only the tail of a partial frame is left behind, move it to the front
+            self.__buffer[0:pending] = self.__buffer[self.__read_pos:self.__write_pos]
+            self.__read_pos = 0
+            self.__write_pos = pending
+
+        frame_size = self.__pending_frame_size()
+        if frame_size > len(self.__buffer):
+            buffer = bytearray(max(frame_size, 2 * len(self.__buffer)))
+            buffer[0:pending] = self.__view[0:pending]
+            self.__view.release()
+            self.__buffer = buffer
+            self.__view = memoryview(buffer)
+
+    def __fill(self) -> None:
+        self.__make_room()
+        n_read = self.__sock.recv_into(self.__view[self.__write_pos:])
+        if n_read == 0:
+            raise EOFError
+        self.__write_pos += n_read
+
+    def __split_frames(self) -> list[HPacket]:
+        packets = []
+        while self.__write_pos - self.__read_pos >= 4:
+            frame_size = self.__pending_frame_size()
+            if self.__write_pos - self.__read_pos < frame_size:
+                break
+            packets.append(HPacket.from_bytes(self.__view[self.__read_pos:self.__read_pos + frame_size]))
+            self.__read_pos += frame_size
+
+        if self.__read_pos == self.__write_pos:
+            self.__read_pos = self.__write_pos = 0
+        return packets
+
+    def read_packets(self) -> list[HPacket]:
+        """
+        Blocks until at least one complete frame is available
+        :return: all complete frames currently buffered, in order of arrival
+        """
+        packets = self.__split_frames()
+        while len(packets) == 0:
+            self.__fill()
+            packets = self.__split_frames()
+        return packets
+
+
+class FlushPolicy(TypedDict):
+    batch_size: NotRequired[int]
+    max_delay: NotRequired[float]
+
+
+FLUSH_POLICY_DEFAULT: FlushPolicy = {"batch_size": 1, "max_delay": 0.0}
+
+
+def send_buffers(sock: socket.socket, buffers: list[bytes | bytearray | memoryview]) -> None:
+    """
+    Writes all buffers with scatter-gather I/O where available, handling partial writes
+    """
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return
+
+    views = [memoryview(buffer) for buffer in buffers]
+    try:
+        start = 0
+        while start < len(views):
+            sent = sock.sendmsg(views[start:start + MAX_IOV])
+            while sent > 0:
+                if sent >= len(views[start]):
+                    sent -= len(views[start])
+                    start += 1
+                else:
+                    views[start] = views[start][sent:]
+                    sent = 0
+            while start < len(views) and len(views[start]) == 0:
+                start += 1
+    finally:
+        # exported buffers can't be resized, so release them before the packets are touched again
+        for view in views:
+            view.release()
+
+
+class FrameWriter:
+    """
+    Outbound side of the G-Earth socket. With the default policy every write goes out immediately as a single
+    sendmsg() without copying the buffers. With batch_size > 1 writes are copied into a pooled buffer and
+    flushed once batch_size frames are pending, or when the oldest one has waited max_delay seconds.
+    """
+
+    def __init__(self, sock: socket.socket, flush_policy: FlushPolicy):
+        self.__sock = sock
+        self.__batch_size = flush_policy['batch_size']
+        self.__max_delay = flush_policy['max_delay']
+        if self.__batch_size > 1 and self.__max_delay <= 0:
+            raise Exception('Flush policy error: max_delay is required when batch_size > 1')
+
+        self.__condition = threading.Condition()
+        self.__closed = False
+
+        self.__pending = bytearray()
+        self.__pending_size = 0
+        self.__pending_frames = 0
+        self.__first_pending = 0.0
+
+        if self.__batch_size > 1:
+            t = threading.Thread(target=self.__flush_thread, daemon=True)
+            t.start()
+
+    def __queue(self, buffers: tuple) -> None:
+        for buffer in buffers:
+            end = self.__pending_size + len(buffer)
+            self.__pending[self.__pending_size:end] = buffer
+            self.__pending_size = end
+
+    def __send_pending(self, buffers: tuple = ()) -> None:
+        pending = memoryview(self.__pending)[:self.__pending_size]
+        try:
+            send_buffers(self.__sock, [pending, *buffers] if self.__pending_size > 0 else list(buffers))
+        finally:
+            pending.release()
+            self.__pending_size = 0
+            self.__pending_frames = 0
+
+    def __flush_thread(self) -> None:
+        with self.__condition:
+            while not self.__closed:
+                if self.__pending_frames == 0:
+                    self.__condition.wait()
+                    continue
+
+                remaining = self.__first_pending + self.__max_delay - time.perf_counter()
+                if remaining > 0:
+                    self.__condition.wait(remaining)
+                else:
+                    try:
+                        self.__send_pending()
+                    except OSError:
+                        return
+
+    def write(self, *buffers: bytes | bytearray, frames: int = 1) -> None:
+        """
+        Writes one or more complete frames according to the flush policy
+        :param buffers: the frames, possibly split up in multiple buffers (e.g. a header and a payload)
+        :param frames: amount of frames in the buffers
+        """
+        with self.__condition:
+            if self.__batch_size <= 1:
+                self.__send_pending(buffers)
+                return
+
+            if self.__pending_frames == 0:
+                self.__first_pending = time.perf_counter()
+                self.__condition.notify()
+            self.__queue(buffers)
+            self.__pending_frames += frames
+
+            if self.__pending_frames >= self.__batch_size:
+                self.__send_pending()
+
+    def write_now(self, *buffers: bytes | bytearray) -> None:
+        """
+        Writes frames right away, preceded by everything that is still pending
+        """
+        with self.__condition:
+            self.__send_pending(buffers)
+
+    def flush(self) -> None:
+        with self.__condition:
+            if self.__pending_frames > 0:
+                self.__send_pending()
+
+    def close(self) -> None:
+        with self.__condition:
+            self.__closed = True
+            self.__pending_size = 0
+            self.__pending_frames = 0
+            self.__condition.notify_all()
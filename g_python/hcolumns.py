@@ -0,0 +1,182 @@
+"""
+Columnar versions of the room parsers in hparsers, for analysing full rooms with NumPy.
+The fixed size fields of every item end up in the columns of one structured array, variable length fields are kept
+in side tables (plain lists) that line up with the rows of that array.
+"""
+import re
+from typing import Any, Callable, NamedTuple
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError('g_python.hcolumns requires numpy, install it with "pip install g-python[numpy]"') from e
+
+from .hpacket import HPacket
+from .hparsers import read_stuff, read_entity_details, get_tile_from_coords, NO_TILE
+
+FLOOR_ITEM_DTYPE = np.dtype([
+    ('id', 'i4'), ('type_id', 'i4'), ('x', 'i4'), ('y', 'i4'), ('z', 'f8'), ('facing', 'i4'), ('height', 'f8'),
+    ('category', 'i4'), ('seconds_to_expiration', 'i4'), ('usage_policy', 'i4'), ('owner_id', 'i4')
+])
+ENTITY_DTYPE = np.dtype([
+    ('id', 'i4'), ('index', 'i4'), ('x', 'i4'), ('y', 'i4'), ('z', 'f8'), ('facing', 'i4'), ('entity_type', 'i4')
+])
+USER_UPDATE_DTYPE = np.dtype([
+    ('index', 'i4'), ('x', 'i4'), ('y', 'i4'), ('z', 'f8'), ('head_facing', 'i4'), ('body_facing', 'i4'),
+    ('next_x', 'i4'), ('next_y', 'i4'), ('next_z', 'f8')
+])
+
+# the next tile of every line of joined action strings, empty groups for lines without a (valid) move
+STATUS_MOVE = re.compile(r'^(?:.*/)?mv (-?\d+),(-?\d+),([^,/\n]*)(?=/|$)|^.*$', re.MULTILINE)
+
+
+class FloorItemColumns(NamedTuple):
+    items: np.ndarray  # FLOOR_ITEM_DTYPE
+    stuff: list[list[int | str]]
+    owners: dict[int, str]
+
+
+class EntityColumns(NamedTuple):
+    entities: np.ndarray  # ENTITY_DTYPE
+    names: list[str]
+    mottos: list[str]
+    figure_ids: list[str]
+    stuff: list[list]
+    genders: list[str | None]
+    favorite_groups: list[str | None]
+
+
+class UserUpdateColumns(NamedTuple):
+    updates: np.ndarray  # USER_UPDATE_DTYPE, next_x and next_y are -1 for users that aren't walking
+    actions: list[str]
+
+
+def parse_floor_items(packet: HPacket) -> FloorItemColumns:
+    """
+    Columnar HFloorItem.parse, for Objects packets
+    """
+    owners = {}
+    for _ in range(packet.read_int()):
+        owner_id = packet.read_int()
+        owners[owner_id] = packet.read_string()
+
+    rows = []
+    stuff = []
+    for _ in range(packet.read_int()):
+        item_id, type_id, x, y, facing, z, height, _, category = packet.read('iiiiissii')
+        stuff.append(read_stuff(packet, category))
+        seconds_to_expiration, usage_policy, owner_id = packet.read('iii')
+        if type_id < 0:
+            packet.read_string()
+
+        rows.append((item_id, type_id, x, y, float(z), facing, float(height), category, seconds_to_expiration,
+                     usage_policy, owner_id))
+
+    return FloorItemColumns(np.array(rows, dtype=FLOOR_ITEM_DTYPE), stuff, owners)
+
+
+def parse_entities(packet: HPacket) -> EntityColumns:
+    """
+    Columnar HEntity.parse, for Users packets
+    """
+    rows = []
+    names, mottos, figure_ids, stuff, genders, favorite_groups = [], [], [], [], [], []
+    for _ in range(packet.read_int()):
+        entity_id, name, motto, figure_id, index, x, y, z, facing, entity_type = packet.read('isssiiisii')
+        details = read_entity_details(packet, entity_type)
+
+        rows.append((entity_id, index, x, y, float(z), facing, entity_type))
+        names.append(name)
+        mottos.append(motto)
+        figure_ids.append(figure_id)
+        stuff.append(details[0])
+        genders.append(details[1])
+        favorite_groups.append(details[2])
+
+    return EntityColumns(np.array(rows, dtype=ENTITY_DTYPE), names, mottos, figure_ids, stuff, genders,
+                         favorite_groups)
+
+
+def convert_distinct(values: tuple[str, ...], convert: Callable[[str], Any]) -> list:
+    """
+    Converts every distinct string once, a room only has a handful of different heights and coordinates
+    """
+    converted = {value: convert(value) for value in set(values)}
+    return [converted[value] for value in values]
+
+
+def to_height(value: str) -> float:
+    return get_tile_from_coords(0, 0, value).z
+
+
+def parse_user_updates(packet: HPacket) -> UserUpdateColumns:
+    """
+    Columnar HUserUpdate.parse, for UserUpdate packets. The raw values are read first, the next tiles of all
+    updates are then found in a single regex pass over their action strings.
+    """
+    read = packet.read
+    rows = [read('iiisiis') for _ in range(packet.read_int())]
+    updates = np.empty(len(rows), dtype=USER_UPDATE_DTYPE)
+    if len(rows) == 0:
+        return UserUpdateColumns(updates, [])
+
+    index, x, y, z, head, body, actions = zip(*rows)
+    updates['index'] = index
+    updates['x'] = x
+    updates['y'] = y
+    updates['z'] = convert_distinct(z, to_height)
+    updates['head_facing'] = head
+    updates['body_facing'] = body
+
+    next_x, next_y, next_z = zip(*STATUS_MOVE.findall('\n'.join(actions)))
+    updates['next_x'] = convert_distinct(next_x, lambda value: int(value) if value else NO_TILE.x)
+    updates['next_y'] = convert_distinct(next_y, lambda value: int(value) if value else NO_TILE.y)
+    updates['next_z'] = convert_distinct(next_z, lambda value: to_height(value) if value else NO_TILE.z)
+
+    return UserUpdateColumns(updates, list(actions))
+
+
+class HHeightMapArray:
+    """
+    NumPy version of HHeightMap, the tiles are a 2D array indexed as [y, x].
+    Single coordinates as well as arrays of coordinates can be passed to the tile queries.
+    """
+
+    def __init__(self, packet: HPacket):
+        self.width, tile_count = packet.read('ii')
+        self.height = tile_count // self.width
+        self.values = np.frombuffer(packet.buffer(), '>i2', tile_count, packet.read_index) \
+            .astype(np.int16).reshape(self.height, self.width)
+        packet.read_index += 2 * tile_count
+
+        self.room_tiles = self.values >= 0
+        self.stacking_blocked = (self.values & 16384) > 0
+        self.heights = np.where(self.room_tiles, (self.values & 16383) / 256, -1.0)
+
+    def are_valid_coords(self, x, y):
+        return (0 <= x) & (x < self.width) & (0 <= y) & (y < self.height)
+
+    def __lookup(self, grid: np.ndarray, x, y, default):
+        valid = self.are_valid_coords(x, y)
+        if np.ndim(valid) == 0:
+            return grid[y, x] if valid else default
+        return np.where(valid, grid[np.where(valid, y, 0), np.where(valid, x, 0)], default)
+
+    def get_tile_value(self, x, y):
+        return self.values[y, x]
+
+    def get_tile_height(self, x, y):
+        return self.__lookup(self.heights, x, y, -1.0)
+
+    def is_room_tile(self, x, y):
+        return self.__lookup(self.room_tiles, x, y, False)
+
+    def is_stacking_blocked(self, x, y):
+        return self.__lookup(self.stacking_blocked, x, y, False)
+
+    def room_tile_coords(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the x and y coordinates of every room tile
+        """
+        y, x = np.nonzero(self.room_tiles)
+        return x, y
@@ -0,0 +1,241 @@
+import re
+import struct
+from functools import lru_cache
+from typing import Callable
+
+from .hdirection import Direction
+from .hpacket import HPacket
+
+DEFAULT_CACHE_SIZE: int = 512
+
+INT = struct.Struct('>i')
+USHORT = struct.Struct('>H')  # G-Earth's u is an unsigned short
+LONG = struct.Struct('>q')
+DOUBLE = struct.Struct('>d')
+BYTE = struct.Struct('>b')
+STRING_LENGTH = struct.Struct('>H')
+PACKET_HEADER = struct.Struct('>ih')
+
+EXPRESSION_TOKEN = re.compile(r'\s*\{(\w+):("(?:[^"\\]|\\.)*"|[^}]*)\}\s*')
+STRING_ESCAPE = re.compile(r'\\(.)')
+STRING_UNESCAPED = {'n': '\n', 'r': '\r'}
+
+# bytes that G-Earth writes as [n] in the string representation of a packet
+ESCAPED_BYTES = frozenset([*range(0, 32), 91, 93, 123, 125, *range(127, 160)])
+STRING_TABLE = tuple('[{}]'.format(i) if i in ESCAPED_BYTES else chr(i) for i in range(256))
+
+
+def packet_to_string(packet: HPacket) -> str:
+    """
+    Renders a packet the way G-Earth's packet_to_string does, without asking G-Earth
+    """
+    return ''.join([STRING_TABLE[b] for b in packet.buffer()])
+
+
+def escape_expression_string(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\r', '\\r').replace('\n', '\\n')
+
+
+def compile_structure(structure: str) -> Callable[[bytes | bytearray | memoryview], str] | None:
+    """
+    Compiles a G-Earth packet structure (e.g. "isB") into a function that renders the packet body as an expression
+    :return: None if the structure contains types that can't be rendered locally
+    """
+    if any(value_type not in 'isbBlud' for value_type in structure):
+        return None
+
+    def render(buffer: bytes | bytearray | memoryview) -> str | None:
+        parts = []
+        index = 6
+        try:
+            for value_type in structure:
+                if value_type == 'i':
+                    parts.append('{{i:{}}}'.format(INT.unpack_from(buffer, index)[0]))
+                    index += 4
+                elif value_type == 's':
+                    length = STRING_LENGTH.unpack_from(buffer, index)[0]
+                    if index + 2 + length > len(buffer):
+                        return None
+                    value = str(buffer[index + 2:index + 2 + length], 'utf-8', 'replace')
+                    parts.append('{{s:"{}"}}'.format(escape_expression_string(value)))
+                    index += 2 + length
+                elif value_type == 'b':
+                    parts.append('{{b:{}}}'.format(BYTE.unpack_from(buffer, index)[0]))
+                    index += 1
+                elif value_type == 'B':
+                    parts.append('{{b:{}}}'.format('true' if buffer[index] != 0 else 'false'))
+                    index += 1
+                elif value_type == 'l':
+                    parts.append('{{l:{}}}'.format(LONG.unpack_from(buffer, index)[0]))
+                    index += 8
+                elif value_type == 'u':
+                    parts.append('{{u:{}}}'.format(USHORT.unpack_from(buffer, index)[0]))
+                    index += 2
+                elif value_type == 'd':
+                    parts.append('{{d:{}}}'.format(DOUBLE.unpack_from(buffer, index)[0]))
+                    index += 8
+        except (struct.error, IndexError):
+            return None
+
+        # a structure that doesn't describe the full packet is wrong, G-Earth would guess the expression instead
+        if index != len(buffer):
+            return None
+        return ''.join(parts)
+
+    return render
+
+
+class PacketFormatter:
+    """
+    Renders G-Earth expressions locally from the packet structures in the packet infos of a connection.
+    Compiled structures are kept in an LRU cache per header.
+    """
+
+    def __init__(self, packet_infos: dict | None, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.__packet_infos = packet_infos
+        self.__compiled = lru_cache(maxsize=cache_size)(self.__compile)
+
+    def __packet_info(self, direction: Direction | None, header_id: int) -> dict | None:
+        if self.__packet_infos is None:
+            return None
+
+        directions = (Direction.TO_CLIENT, Direction.TO_SERVER) if direction is None else (direction,)
+        candidates = [(d, self.__packet_infos[d][header_id])
+                      for d in directions if header_id in self.__packet_infos[d]]
+        # without a direction, a header id that exists both ways can't be resolved
+        if len(candidates) != 1:
+            return None
+
+        d, infos = candidates[0]
+        for info in infos:
+            if info['Structure'] is not None:
+                return {**info, 'Direction': d}
+        return None
+
+    def __compile(self, direction: Direction | None, header_id: int) -> tuple[str, Callable] | None:
+        info = self.__packet_info(direction, header_id)
+        if info is None:
+            return None
+
+        render = compile_structure(info['Structure'])
+        if render is None:
+            return None
+
+        if info['Name'] is not None:
+            prefix = '{{{}:{}}}'.format('in' if info['Direction'] == Direction.TO_CLIENT else 'out', info['Name'])
+        else:
+            prefix = '{{h:{}}}'.format(header_id)
+        return prefix, render
+
+    def to_expression(self, packet: HPacket, direction: Direction | None = None) -> str | None:
+        """
+        :return: the G-Earth expression of the packet, or None if it can't be rendered from a known structure
+        """
+        if packet.is_incomplete_packet() or packet.is_corrupted():
+            return None
+
+        compiled = self.__compiled(direction, packet.header_id())
+        if compiled is None:
+            return None
+
+        prefix, render = compiled
+        body = render(packet.buffer())
+        return None if body is None else prefix + body
+
+
+class ExpressionTemplate:
+    """
+    A compiled G-Earth expression: the packet body is assembled once, only the header id is resolved per packet
+    """
+
+    def __init__(self, identifier: int | str, direction: Direction | None, payload: bytes):
+        self.identifier = identifier
+        self.direction = direction
+        self.payload = payload
+
+    def to_packet(self, direction: Direction | None, packet_infos: dict | None) -> HPacket | None:
+        """
+        :param direction: direction the packet will be sent in, if known
+        :return: None if the header can't be resolved
+        """
+        if self.direction is not None:
+            if direction is not None and direction != self.direction:
+                return None
+            direction = self.direction
+
+        if type(self.identifier) is int:
+            header_id = self.identifier
+        elif direction is not None and packet_infos is not None and self.identifier in packet_infos[direction]:
+            header_id = packet_infos[direction][self.identifier][0]['Id']
+        else:
+            return None
+
+        return HPacket.from_buffer(PACKET_HEADER.pack(len(self.payload) + 2, header_id) + self.payload)
+
+
+def unescape_expression_string(value: str) -> str:
+    return STRING_ESCAPE.sub(lambda match: STRING_UNESCAPED.get(match.group(1), match.group(1)), value)
+
+
+def encode_expression_value(value_type: str, value: str) -> bytes | None:
+    try:
+        if value_type == 'i':
+            return INT.pack(int(value))
+        if value_type == 's':
+            if len(value) < 2 or value[0] != '"' or value[-1] != '"':
+                return None
+            encoded = unescape_expression_string(value[1:-1]).encode('utf-8')
+            return STRING_LENGTH.pack(len(encoded)) + encoded
+        if value_type == 'b':
+            if value in ('true', 'false'):
+                return b'\x01' if value == 'true' else b'\x00'
+            return (int(value) & 0xff).to_bytes(1, byteorder='big') if -128 <= int(value) <= 255 else None
+        if value_type == 'l':
+            return LONG.pack(int(value))
+        if value_type == 'u':
+            return USHORT.pack(int(value))
+        if value_type == 'd':
+            return DOUBLE.pack(float(value))
+    except (ValueError, struct.error):
+        return None
+    return None
+
+
+@lru_cache(maxsize=DEFAULT_CACHE_SIZE)
+def compile_expression(expression: str) -> ExpressionTemplate | None:
+    """
+    Compiles an expression like {out:MoveAvatar}{i:3}{i:5} or {h:1234}{s:"text"}{b:true}
+    :return: None if the expression can't be compiled locally (e.g. it uses the [0][0] string format)
+    """
+    tokens = []
+    position = 0
+    while position < len(expression):
+        match = EXPRESSION_TOKEN.match(expression, position)
+        if match is None:
+            return None
+        tokens.append((match.group(1), match.group(2)))
+        position = match.end()
+
+    if len(tokens) == 0:
+        return None
+
+    header_type, header_value = tokens[0]
+    if header_type == 'h':
+        try:
+            identifier, direction = int(header_value), None
+        except ValueError:
+            return None
+    elif header_type in ('in', 'out'):
+        identifier = header_value
+        direction = Direction.TO_CLIENT if header_type == 'in' else Direction.TO_SERVER
+    else:
+        return None
+
+    parts = []
+    for (value_type, value) in tokens[1:]:
+        encoded = encode_expression_value(value_type, value)
+        if encoded is None:
+            return None
+        parts.append(encoded)
+
+    return ExpressionTemplate(identifier, direction, b''.join(parts))
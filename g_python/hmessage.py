@@ -4,12 +4,34 @@ from .hpacket import HPacket
 from .hdirection import Direction
 
 
+def intercept_offsets(frame: bytes | bytearray) -> tuple[int, int]:
+    """
+    :return: positions of the tabs after the index and the direction in a PACKET_INTERCEPT packet
+    """
+    # int length, short header id, int string length, then "blocked\tindex\tdirection\tedited" + packet bytes
+    index_end = frame.index(9, 12)
+    return index_end, frame.index(9, index_end + 1)
+
+
+def peek_intercept(frame: bytes | bytearray) -> tuple[Direction, int]:
+    """
+    :return: direction and header id of an intercepted packet, without parsing the rest
+    """
+    index_end, direction_end = intercept_offsets(frame)
+    direction = Direction.TO_CLIENT if frame[index_end + 1:direction_end] == b'TOCLIENT' else Direction.TO_SERVER
+    return direction, int.from_bytes(frame[direction_end + 6:direction_end + 8], byteorder='big', signed=True)
+
+
 class HMessage:
+    __slots__ = ('packet', 'direction', '_index', 'is_blocked', '_frame', '_packet_offset')
+
     def __init__(self, packet: HPacket, direction: Direction, index: int, is_blocked: bool = False):
         self.packet = packet
         self.direction = direction
         self._index = index
         self.is_blocked = is_blocked
+        self._frame = None
+        self._packet_offset = 0
 
     @classmethod
     def reconstruct_from_java(cls, string: str) -> Self:
@@ -21,6 +43,30 @@ class HMessage:
         obj._index = int(split[1])
         obj.direction = Direction.TO_CLIENT if split[2] == 'TOCLIENT' else Direction.TO_SERVER
         obj.packet = HPacket.reconstruct_from_java(split[3])
+        obj._frame = None
+        obj._packet_offset = 0
+        return obj
+
+    @classmethod
+    def from_intercept(cls, frame: bytes | bytearray) -> Self:
+        """
+        Parses a PACKET_INTERCEPT packet from G-Earth straight from its bytes, the habbo packet is a view on the
+        frame until it gets changed
+        """
+        obj = cls.__new__(cls)
+        super(HMessage, obj).__init__()
+
+        index_end, direction_end = intercept_offsets(frame)
+
+        obj.is_blocked = frame[10] == 49
+        obj._index = int(frame[12:index_end])
+        obj.direction = Direction.TO_CLIENT if frame[index_end + 1:direction_end] == b'TOCLIENT' \
+            else Direction.TO_SERVER
+        obj.packet = HPacket.from_buffer(memoryview(frame)[direction_end + 2:])
+        obj.packet.is_edited = frame[direction_end + 1] == 49
+
+        obj._frame = frame
+        obj._packet_offset = direction_end + 2
         return obj
 
     def __repr__(self) -> str:
@@ -31,5 +77,28 @@ class HMessage:
             repr(self.packet)
         )
 
+    def java_buffers(self) -> tuple[bytes | bytearray, bytes | bytearray | memoryview]:
+        """
+        Byte-level equivalent of repr(), split up in the message metadata and the packet bytes. A packet that
+        wasn't changed is echoed straight from the frame it was received in, with only the flags patched.
+        """
+        buffer = self.packet.buffer()
+        if self._frame is not None:
+            received = memoryview(self._frame)[self._packet_offset:]
+            untouched = type(buffer) is memoryview and buffer.obj is self._frame and len(buffer) == len(received)
+            if untouched or buffer == received:
+                meta = bytearray(self._frame[10:self._packet_offset])
+                meta[0] = 49 if self.is_blocked else 48
+                meta[-1] = 49 if self.packet.is_edited else 48
+                return meta, received
+
+        meta = '{}\t{}\t{}\t{}'.format(
+            '1' if self.is_blocked else '0',
+            self._index,
+            'TOCLIENT' if self.direction == Direction.TO_CLIENT else 'TOSERVER',
+            '1' if self.packet.is_edited else '0'
+        )
+        return meta.encode(), buffer
+
     def index(self) -> int:
         return self._index
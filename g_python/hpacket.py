@@ -1,14 +1,61 @@
-from typing import Self
+from __future__ import annotations
+
+import struct
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Self, TYPE_CHECKING, Iterator
 
-from .gextension import Extension
 from .hdirection import Direction
 
+if TYPE_CHECKING:
+    from .gextension import Extension
+
+PACKET_HEADER = struct.Struct('>ih')
+STRING_LENGTH = struct.Struct('>H')
+INT = struct.Struct('>i')
+SHORT = struct.Struct('>h')
+LONG = struct.Struct('>q')
+
+# struct codes of the fixed size types in a packet structure (HPacket.read() notation)
+STRUCT_CODES = {'i': 'i', 'u': 'h', 'l': 'q', 'b': 'B', 'B': '?'}
+VALUE_SIZES = {'i': 4, 'u': 2, 'l': 8, 'b': 1, 'B': 1}
+
+
+@lru_cache(maxsize=1024)
+def structure_segments(structure: str) -> tuple[tuple[struct.Struct | None, int], ...]:
+    """
+    Compiles a packet structure like 'isssiiisii' into runs of fixed size fields, so every run is packed or
+    unpacked with a single struct call
+    :return: (struct, amount of values) per run, a string is a run of its own without a struct
+    """
+    segments = []
+    codes = ''
+    for value_type in structure:
+        if value_type == 's':
+            if codes != '':
+                segments.append((struct.Struct('>' + codes), len(codes)))
+                codes = ''
+            segments.append((None, 1))
+        elif value_type in STRUCT_CODES:
+            codes += STRUCT_CODES[value_type]
+        else:
+            raise Exception('Invalid value type in packet structure: {}'.format(value_type))
+    if codes != '':
+        segments.append((struct.Struct('>' + codes), len(codes)))
+    return tuple(segments)
+
 
 class HPacket:
+    # extension: the extension that intercepted the packet, used before default_extension to resolve names
+    # _editing: nesting depth of editing() sessions, the length header is only fixed when the outermost one ends
+    __slots__ = ('_buffer', 'read_index', 'is_edited', 'incomplete_identifier', 'extension', '_editing')
+
     default_extension: Extension | None = None
 
     def __init__(self, identifier: int | str, *objects: str | int | bool | bytes):
         self.incomplete_identifier = None if (type(identifier) is int) else identifier
+        self.extension = None
+        self._editing = 0
 
         self.read_index = 6
         self.bytearray = bytearray(b'\x00\x00\x00\x02\xff\xff')
@@ -16,24 +63,25 @@ class HPacket:
             self.replace_short(4, identifier)
         self.is_edited = False
 
-        for obj in objects:
-            if type(obj) is str:
-                self.append_string(obj)
-            if type(obj) is int:
-                self.append_int(obj)
-            if type(obj) is bool:
-                self.append_bool(obj)
-            if type(obj) is bytes:
-                self.append_bytes(obj)
+        with self.editing():
+            for obj in objects:
+                if type(obj) is str:
+                    self.append_string(obj)
+                elif type(obj) is int:
+                    self.append_int(obj)
+                elif type(obj) is bool:
+                    self.append_bool(obj)
+                elif type(obj) is bytes:
+                    self.append_bytes(obj)
 
         self.is_edited = False
 
     def fill_id(self, direction: Direction, extension: Extension | None = None) -> bool:
         if self.incomplete_identifier is not None:
             if extension is None:
-                if self.default_extension is None:
+                extension = self.__extension()
+                if extension is None:
                     return False
-                extension = self.default_extension
 
             if extension.packet_infos is not None and self.incomplete_identifier in extension.packet_infos[direction]:
                 edited_old = self.is_edited
@@ -44,6 +92,23 @@ class HPacket:
             return False
         return True
 
+    @property
+    def bytearray(self) -> bytearray:
+        if type(self._buffer) is not bytearray:
+            # copy-on-write for packets that wrap a buffer they don't own
+            self._buffer = bytearray(self._buffer)
+        return self._buffer
+
+    @bytearray.setter
+    def bytearray(self, value: bytearray) -> None:
+        self._buffer = value
+
+    def buffer(self) -> bytearray | memoryview:
+        """
+        :return: the packet bytes without copying them, not to be modified
+        """
+        return self._buffer
+
     # https://stackoverflow.com/questions/682504/what-is-a-clean-pythonic-way-to-have-multiple-constructors-in-python
     @classmethod
     def from_bytes(cls, byte_list: bytes) -> Self:
@@ -52,6 +117,24 @@ class HPacket:
         obj.bytearray = bytearray(byte_list)
         obj.read_index = 6
         obj.is_edited = False
+        obj.incomplete_identifier = None
+        obj.extension = None
+        obj._editing = 0
+        return obj
+
+    @classmethod
+    def from_buffer(cls, buffer: bytes | memoryview) -> Self:
+        """
+        Wraps the bytes of a received packet without copying them, they are only copied once the packet is changed
+        """
+        obj = cls.__new__(cls)
+        super(HPacket, obj).__init__()
+        obj._buffer = buffer
+        obj.read_index = 6
+        obj.is_edited = False
+        obj.incomplete_identifier = None
+        obj.extension = None
+        obj._editing = 0
         return obj
 
     @classmethod
@@ -72,13 +155,15 @@ class HPacket:
         obj.bytearray = bytearray(string[1:].encode("iso-8859-1"))
         obj.is_edited = string[0] == '1'
         obj.incomplete_identifier = None
+        obj.extension = None
+        obj._editing = 0
         return obj
 
     def __repr__(self) -> str:
-        return ('1' if self.is_edited else '0') + self.bytearray.decode("iso-8859-1")
+        return ('1' if self.is_edited else '0') + str(self._buffer, "iso-8859-1")
 
     def __bytes__(self) -> bytes:
-        return bytes(self.bytearray)
+        return bytes(self._buffer)
 
     def __len__(self) -> int:
         return self.read_int(0)
@@ -90,29 +175,30 @@ class HPacket:
             bytes(self)
         )
 
+    def __extension(self) -> Extension | None:
+        return self.extension if self.extension is not None else HPacket.default_extension
+
     def is_incomplete_packet(self) -> bool:
         return self.incomplete_identifier is not None
 
     def g_string(self, extension: Extension | None = None) -> str:
         if extension is None:
-            if HPacket.default_extension is None:
+            extension = self.__extension()
+            if extension is None:
                 raise Exception('No extension given for packet <-> string conversion')
-            else:
-                extension = HPacket.default_extension
 
         return extension.packet_to_string(self)
 
-    def g_expression(self, extension: Extension | None = None) -> str:
+    def g_expression(self, extension: Extension | None = None, direction: Direction | None = None) -> str:
         if extension is None:
-            if HPacket.default_extension is None:
+            extension = self.__extension()
+            if extension is None:
                 raise Exception('No extension given for packet <-> string conversion')
-            else:
-                extension = HPacket.default_extension
 
-        return extension.packet_to_expression(self)
+        return extension.packet_to_expression(self, direction)
 
     def is_corrupted(self) -> bool:
-        return len(self.bytearray) < 6 or self.read_int(0) != len(self.bytearray) - 4
+        return len(self._buffer) < 6 or self.read_int(0) != len(self._buffer) - 4
 
     def reset(self) -> None:
         self.read_index = 6
@@ -121,55 +207,125 @@ class HPacket:
         return self.read_short(4)
 
     def fix_length(self) -> None:
-        self.replace_int(0, len(self.bytearray) - 4)
+        if self._editing == 0:
+            self.replace_int(0, len(self.bytearray) - 4)
+
+    @contextmanager
+    def editing(self) -> Iterator[Self]:
+        """
+        Defers fixing the length header until the end of the block, for packets that get many values appended or
+        replaced. The length read from the packet is stale inside the block.
+
+        with packet.editing():
+            for friend in friends:
+                packet.append_int(friend.id).append_string(friend.name)
+        """
+        self._editing += 1
+        try:
+            yield self
+        finally:
+            self._editing -= 1
+            self.fix_length()
 
     def read_int(self, index=None) -> int:
         if index is None:
             index = self.read_index
             self.read_index += 4
 
-        return int.from_bytes(self.bytearray[index:index + 4], byteorder='big', signed=True)
+        try:
+            return INT.unpack_from(self._buffer, index)[0]
+        except struct.error:
+            return int.from_bytes(self._buffer[index:index + 4], byteorder='big', signed=True)
 
     def read_short(self, index=None) -> int:
         if index is None:
             index = self.read_index
             self.read_index += 2
 
-        return int.from_bytes(self.bytearray[index:index + 2], byteorder='big', signed=True)
+        try:
+            return SHORT.unpack_from(self._buffer, index)[0]
+        except struct.error:
+            return int.from_bytes(self._buffer[index:index + 2], byteorder='big', signed=True)
 
     def read_long(self, index=None) -> int:
         if index is None:
             index = self.read_index
             self.read_index += 8
 
-        return int.from_bytes(self.bytearray[index:index + 8], byteorder='big', signed=True)
+        try:
+            return LONG.unpack_from(self._buffer, index)[0]
+        except struct.error:
+            return int.from_bytes(self._buffer[index:index + 8], byteorder='big', signed=True)
 
     def read_string(self, index=None, head: int = 2, encoding: str = 'iso-8859-1') -> str:
         if index is None:
             index = self.read_index
-            self.read_index += head + int.from_bytes(self.bytearray[index:index + head], byteorder='big', signed=False)
+            self.read_index += head + int.from_bytes(self._buffer[index:index + head], byteorder='big', signed=False)
 
-        length = int.from_bytes(self.bytearray[index:index + head], byteorder='big', signed=False)
-        return self.bytearray[index + head:index + head + length].decode(encoding)
+        length = int.from_bytes(self._buffer[index:index + head], byteorder='big', signed=False)
+        return str(self._buffer[index + head:index + head + length], encoding)
 
     def read_bytes(self, length: int, index: int | None = None) -> bytearray:
         if index is None:
             index = self.read_index
             self.read_index += length
 
-        return self.bytearray[index:index + length]
+        return bytearray(self._buffer[index:index + length])
 
     def read_byte(self, index: int | None = None) -> int:
         if index is None:
             index = self.read_index
             self.read_index += 1
 
-        return self.bytearray[index]
+        return self._buffer[index]
 
     def read_bool(self, index: int | None = None) -> bool:
         return self.read_byte(index) != 0
 
     def read(self, structure: str) -> list:
+        """
+        Reads values in the order of the structure, using a cached read plan for the structure
+        """
+        buffer = self._buffer
+        index = self.read_index
+        values = []
+        try:
+            for (fields, count) in structure_segments(structure):
+                if fields is None:
+                    end = index + 2 + STRING_LENGTH.unpack_from(buffer, index)[0]
+                    if end > len(buffer):
+                        raise struct.error('string out of bounds')
+                    values.append(str(buffer[index + 2:end], 'iso-8859-1'))
+                    index = end
+                else:
+                    values.extend(fields.unpack_from(buffer, index))
+                    index += fields.size
+        except struct.error:
+            # truncated packet, read it value by value to keep the lenient behaviour of the read methods
+            return self.__read_values(structure)
+
+        self.read_index = index
+        return values
+
+    def skip(self, structure: str) -> list[int]:
+        """
+        Moves the read index past the values of the structure without decoding them
+        :return: the index of every value, so they can be decoded later on
+        """
+        buffer = self._buffer
+        index = self.read_index
+        offsets = []
+        for value_type in structure:
+            offsets.append(index)
+            if value_type == 's':
+                index += 2 + STRING_LENGTH.unpack_from(buffer, index)[0]
+            else:
+                index += VALUE_SIZES[value_type]
+
+        self.read_index = index
+        return offsets
+
+    def __read_values(self, structure: str) -> list:
         read_methods = {
             'i': self.read_int,
             's': self.read_string,
@@ -197,15 +353,11 @@ class HPacket:
         self.is_edited = True
 
     def replace_string(self, index: int, value: str, encoding: str = 'utf-8') -> None:
-        old_len = self.read_short(index)
-        part1 = self.bytearray[0:index]
-        part3 = self.bytearray[index + 2 + old_len:]
-
+        old_len = STRING_LENGTH.unpack_from(self._buffer, index)[0]
         new_string = value.encode(encoding)
-        new_len = len(new_string)
-        part2 = new_len.to_bytes(2, byteorder='big', signed=False) + new_string
 
-        self.bytearray = part1 + part2 + part3
+        # splice the new string in place, only the bytes after it are moved
+        self.bytearray[index:index + 2 + old_len] = STRING_LENGTH.pack(len(new_string)) + new_string
         self.fix_length()
         self.is_edited = True
 
@@ -234,10 +386,7 @@ class HPacket:
         return self
 
     def append_bool(self, value: bool) -> Self:
-        self.append_bytes(b'\x01' if value else b'\x00')
-        self.fix_length()
-        self.is_edited = True
-        return self
+        return self.append_bytes(b'\x01' if value else b'\x00')
 
     def append_string(self, value: str, head: int = 2, encoding: str = 'utf-8'):
         b = value.encode(encoding)
@@ -245,3 +394,88 @@ class HPacket:
         self.fix_length()
         self.is_edited = True
         return self
+
+
+class PacketTemplate:
+    """
+    Precompiled packet shape for packets that are sent over and over. Fixed size fields are packed with a cached
+    struct.Struct, names and hashes are resolved once per connection.
+    """
+
+    def __init__(self, direction: Direction, identifier: int | str, structure: str):
+        """
+        :param structure: value types, same notation as HPacket.read(), e.g. 'isB'
+        """
+        self.direction = direction
+        self.identifier = identifier
+        self.structure = structure
+
+        self.__segments = structure_segments(structure)
+
+        # without strings, the size of the packet and thus its whole header is known up front
+        self.__fixed = None
+        if len(self.__segments) == 0:
+            self.__fixed = struct.Struct('>')
+        elif len(self.__segments) == 1 and self.__segments[0][0] is not None:
+            self.__fixed = self.__segments[0][0]
+
+        # (packet infos, header id, packet header of a fixed size packet), replaced at once when resolved again
+        self.__resolved = self.__resolve(None, identifier if type(identifier) is int else None)
+
+    def __resolve(self, packet_infos: dict | None, header_id: int | None) -> tuple:
+        fixed_header = None
+        if self.__fixed is not None and header_id is not None:
+            fixed_header = PACKET_HEADER.pack(self.__fixed.size + 2, header_id)
+        return packet_infos, header_id, fixed_header
+
+    def __resolved_header(self, extension: Extension | None) -> tuple:
+        if type(self.identifier) is int:
+            return self.__resolved
+
+        if extension is None:
+            extension = HPacket.default_extension
+        packet_infos = None if extension is None else extension.packet_infos
+        if packet_infos is not self.__resolved[0]:
+            header_id = None
+            if packet_infos is not None and self.identifier in packet_infos[self.direction]:
+                header_id = packet_infos[self.direction][self.identifier][0]['Id']
+            self.__resolved = self.__resolve(packet_infos, header_id)
+        return self.__resolved
+
+    def header_id(self, extension: Extension | None = None) -> int | None:
+        """
+        :return: the header id for the current connection of the extension, None if it can't be resolved
+        """
+        return self.__resolved_header(extension)[1]
+
+    def pack(self, *values: int | str | bool, extension: Extension | None = None) -> bytes | None:
+        """
+        :return: the complete packet bytes, or None if the header couldn't be resolved
+        """
+        _, header_id, fixed_header = self.__resolved_header(extension)
+        if header_id is None:
+            return None
+
+        if self.__fixed is not None:
+            return fixed_header + self.__fixed.pack(*values)
+
+        if len(values) != len(self.structure):
+            raise Exception('Packet structure {} expects {} values, got {}'.format(self.structure,
+                                                                                 len(self.structure), len(values)))
+        parts = []
+        index = 0
+        for (fields, count) in self.__segments:
+            if fields is None:
+                encoded = values[index].encode('utf-8')
+                parts.append(STRING_LENGTH.pack(len(encoded)))
+                parts.append(encoded)
+            else:
+                parts.append(fields.pack(*values[index:index + count]))
+            index += count
+
+        body = b''.join(parts)
+        return PACKET_HEADER.pack(len(body) + 2, header_id) + body
+
+    def build(self, *values: int | str | bool, extension: Extension | None = None) -> HPacket | None:
+        packet = self.pack(*values, extension=extension)
+        return None if packet is None else HPacket.from_buffer(packet)
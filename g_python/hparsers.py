@@ -1,5 +1,9 @@
+import re
+import struct
 from enum import IntEnum, StrEnum
-from typing import Self, TypedDict
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Callable, Mapping, Self, TypedDict, NamedTuple
 
 from g_python.hpacket import HPacket
 
@@ -164,11 +168,13 @@ class HProductType(StrEnum):
     BADGE = 'B'
 
 
-class HPoint:
-    def __init__(self, x: int, y: int, z: float = 0.0):
-        self.x = x
-        self.y = y
-        self.z = z
+class HPoint(NamedTuple):
+    """
+    Immutable, so a single point can be shared by any amount of updates
+    """
+    x: int
+    y: int
+    z: float = 0.0
 
     def __str__(self) -> str:
         return "x: {}, y: {}, z: {}".format(self.x, self.y, self.z)
@@ -177,13 +183,110 @@ class HPoint:
         return "HPoint({},{},{})".format(self.x, self.y, self.z)
 
 
-class HUserUpdate:
+NO_TILE = HPoint(-1, -1, 0.0)
+
+STATUS_ACTION = re.compile(r'([^/ ]+) ?([^/]*)')
+MOVE_ACTION = re.compile(r'(?:^|/)mv ([^/]*)')
+
+
+class LazyParser:
+    """
+    Base of lazily parsed objects: a field is decoded by its entry in _decoders on first access, then cached in the
+    slot the eagerly parsed class declares for it
+    """
+    __slots__ = ()
+    _decoders: dict[str, Callable[[Any], Any]] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        # only called while the slot is still empty
+        decode = self._decoders.get(name)
+        if decode is None:
+            raise AttributeError(name)
+        value = decode(self)
+        setattr(self, name, value)
+        return value
+
+
+def parse_lazily(packet: HPacket, cls: type) -> list:
+    """
+    Locates a list of lazily parsed objects, the objects share one copy of the packet bytes to decode from later on
+    """
+    snapshot = HPacket.from_buffer(bytes(packet.buffer()))
+    snapshot.read_index = packet.read_index
+    objects = [cls(snapshot) for _ in range(snapshot.read_int())]
+    packet.read_index = snapshot.read_index
+    return objects
+
+
+class HUserStatus(NamedTuple):
+    """
+    The action string of a user update (e.g. "/flatctrl 4/mv 3,4,0.0//") parsed into its parts
+    """
+    move: HPoint  # NO_TILE if the user isn't walking
+    sit: float | None
+    lay: float | None
+    sign: int | None
+    flat_control: str | None
+    actions: Mapping[str, str]  # every action by name, including the ones above
+
+
+@lru_cache(maxsize=4096)
+def parse_move(action: str) -> HPoint:
+    """
+    Only the tile a user is walking to, without parsing the rest of the action string
+    :return: NO_TILE if the user isn't walking
+    """
+    match = MOVE_ACTION.search(action)
+    if match is None:
+        return NO_TILE
+
+    coords = match.group(1).split(',')
+    if len(coords) != 3:
+        return NO_TILE
+    try:
+        return get_tile_from_coords(int(coords[0]), int(coords[1]), coords[2])
+    except ValueError:
+        return NO_TILE
+
+
+@lru_cache(maxsize=4096)
+def parse_status(action: str) -> HUserStatus:
+    """
+    Cached, the same handful of action strings come back in every status packet of a room.
+    Values that can't be converted (e.g. a sit without a height) are None.
+    """
+    # read-only, the status is shared by every update with the same action string
+    actions = MappingProxyType(dict(STATUS_ACTION.findall(action)))
+
+    def convert(name: str, to_value: Callable[[str], Any]) -> Any | None:
+        value = actions.get(name)
+        if value is None:
+            return None
+        try:
+            return to_value(value.split(' ')[0])
+        except ValueError:
+            return None
+
+    return HUserStatus(parse_move(action), convert('sit', float), convert('lay', float), convert('sign', int),
+                       actions.get('flatctrl'), actions)
+
+
+class HUserUpdate(LazyParser):
+    """
+    Facings, next tile and status are decoded on first access, a status packet is mostly used for the tiles
+    """
+    __slots__ = ('index', 'action', 'tile', 'headFacing', 'bodyFacing', 'nextTile', 'status', '_head', '_body')
+
     def __init__(self, packet: HPacket):
-        self.index, x, y, z, head, body, self.action = packet.read('iiisiis')
+        self.index, x, y, z, self._head, self._body, self.action = packet.read('iiisiis')
         self.tile = get_tile_from_coords(x, y, z)
-        self.headFacing = HDirection(head)
-        self.bodyFacing = HDirection(body)
-        self.nextTile = self.predict_next_tile()
+
+    _decoders = {
+        'headFacing': lambda self: HDirection(self._head),
+        'bodyFacing': lambda self: HDirection(self._body),
+        'nextTile': lambda self: parse_move(self.action),
+        'status': lambda self: parse_status(self.action),
+    }
 
     def __str__(self):
         return '<HUserUpdate> [{}] - X: {} - Y: {} - Z: {} - head {} - body {} - next tile {}' \
@@ -191,12 +294,7 @@ class HUserUpdate:
                     self.nextTile)
 
     def predict_next_tile(self):
-        actions = self.action.split('/mv ')
-        if len(actions) > 1:
-            (x, y, z) = actions[1].replace('/', '').split(',')
-            return get_tile_from_coords(int(x), int(y), z)
-        else:
-            return HPoint(-1, -1, 0.0)
+        return self.status.move
 
     @classmethod
     def parse(cls, packet):
@@ -204,6 +302,9 @@ class HUserUpdate:
 
 
 class HEntity:
+    __slots__ = ('id', 'name', 'motto', 'figure_id', 'index', 'tile', 'nextTile', 'headFacing', 'bodyFacing',
+                 'entity_type', 'stuff', 'gender', 'favorite_group')
+
     def __init__(self, packet: HPacket):
         self.id, self.name, self.motto, self.figure_id, self.index, x, y, z, facing_id, entity_type_id = \
             packet.read('isssiiisii')
@@ -212,18 +313,23 @@ class HEntity:
         self.headFacing = HDirection(facing_id)
         self.bodyFacing = HDirection(facing_id)
         self.entity_type = HEntityType(entity_type_id)
+        self._read_details(packet)
+
+    def _read_details(self, packet: HPacket) -> None:
+        self.stuff, gender, favorite_group = read_entity_details(packet, self.entity_type)
+        if self.entity_type == HEntityType.HABBO:
+            self.gender = gender
+            self.favorite_group = favorite_group
 
-        self.stuff = []
+    def _skip_details(self, packet: HPacket) -> None:
         if self.entity_type == HEntityType.HABBO:
-            self.gender = packet.read_string()
-            self.stuff.extend(packet.read('ii'))
-            self.favorite_group = packet.read_string()
-            self.stuff.extend(packet.read('siB'))
+            packet.skip('siissiB')
         elif self.entity_type == HEntityType.PET:
-            self.stuff.extend(packet.read('iisiBBBBBBis'))
+            packet.skip('iisiBBBBBBis')
         elif self.entity_type == HEntityType.BOT:
-            self.stuff.extend(packet.read('sis'))
-            self.stuff.append([packet.read_short() for _ in range(packet.read_int())])
+            packet.skip('sis')
+            count = packet.read_int()
+            packet.read_index += 2 * count
 
     def __str__(self) -> str:
         return '{}: {} - {}'.format(self.index, self.name, self.entity_type.name)
@@ -236,10 +342,57 @@ class HEntity:
             self.bodyFacing = update.bodyFacing
 
     @classmethod
-    def parse(cls, packet: HPacket) -> list[Self]:
+    def parse(cls, packet: HPacket, lazy: bool = False) -> list[Self]:
+        """
+        :param lazy: only locate the fields of every entity, they are decoded once they're accessed (see HLazyEntity)
+        """
+        if lazy:
+            return parse_lazily(packet, HLazyEntity)
         return [HEntity(packet) for _ in range(packet.read_int())]
 
 
+class HLazyEntity(LazyParser, HEntity):
+    """
+    HEntity of which only the entity type is decoded up front, every other field is decoded on first access
+    """
+    __slots__ = ('_packet', '_offsets', '_details_offset', '_details_decoded')
+
+    def __init__(self, packet: HPacket):
+        self._packet = packet
+        self._offsets = packet.skip('isssiiisii')
+        self.entity_type = HEntityType(packet.read_int(self._offsets[9]))
+        self.nextTile = None
+
+        self._details_offset = packet.read_index
+        self._details_decoded = False
+        self._skip_details(packet)
+
+    def _decode_details(self, name: str) -> Any:
+        if not self._details_decoded:
+            self._details_decoded = True
+            packet = HPacket.from_buffer(self._packet.buffer())
+            packet.read_index = self._details_offset
+            self._read_details(packet)
+
+        # only habbos have a gender and a favorite group, for others this still raises an AttributeError
+        return object.__getattribute__(self, name)
+
+    _decoders = {
+        'id': lambda self: self._packet.read_int(self._offsets[0]),
+        'name': lambda self: self._packet.read_string(self._offsets[1]),
+        'motto': lambda self: self._packet.read_string(self._offsets[2]),
+        'figure_id': lambda self: self._packet.read_string(self._offsets[3]),
+        'index': lambda self: self._packet.read_int(self._offsets[4]),
+        'tile': lambda self: HPoint(self._packet.read_int(self._offsets[5]), self._packet.read_int(self._offsets[6]),
+                                    float(self._packet.read_string(self._offsets[7]))),
+        'headFacing': lambda self: HDirection(self._packet.read_int(self._offsets[8])),
+        'bodyFacing': lambda self: HDirection(self._packet.read_int(self._offsets[8])),
+        'stuff': lambda self: self._decode_details('stuff'),
+        'gender': lambda self: self._decode_details('gender'),
+        'favorite_group': lambda self: self._decode_details('favorite_group'),
+    }
+
+
 """
 class HFriends:
     def __init__(self, packet):
@@ -256,6 +409,10 @@ class HFriends:
 
 
 class HFriend:
+    __slots__ = ('id', 'name', 'gender', 'online', 'following_allowed', 'figure', 'category_id', 'motto',
+                 'real_name', 'facebook_id', 'persisted_message_user', 'vip_member', 'pocket_habbo_user',
+                 'relationship_status', 'category_name')
+
     def __init__(self, packet: HPacket):
         self.id, self.name, gender_id, self.online, self.following_allowed, self.figure, self.category_id, \
             self.motto, self.real_name, self.facebook_id, self.persisted_message_user, self.vip_member, \
@@ -317,6 +474,31 @@ def read_stuff(packet: HPacket, category: int) -> list[int | str]:
     return stuff
 
 
+def read_entity_details(packet: HPacket, entity_type: int) -> tuple[list, str | None, str | None]:
+    """
+    Reads the entity type dependent part of an entity
+    :return: stuff, gender and favorite group, the latter two are None for anything but habbos
+    """
+    stuff = []
+    gender = favorite_group = None
+    if entity_type == HEntityType.HABBO:
+        gender = packet.read_string()
+        stuff.extend(packet.read('ii'))
+        favorite_group = packet.read_string()
+        stuff.extend(packet.read('siB'))
+    elif entity_type == HEntityType.PET:
+        stuff.extend(packet.read('iisiBBBBBBis'))
+    elif entity_type == HEntityType.BOT:
+        stuff.extend(packet.read('sis'))
+        stuff.append([packet.read_short() for _ in range(packet.read_int())])
+
+    return stuff, gender, favorite_group
+
+
+def next_tile_from_action(action: str) -> HPoint:
+    return parse_move(action)
+
+
 def get_tile_from_coords(x: int, y: int, z: float) -> HPoint:
     try:
         z = float(z)
@@ -327,6 +509,9 @@ def get_tile_from_coords(x: int, y: int, z: float) -> HPoint:
 
 
 class HFloorItem:
+    __slots__ = ('id', 'type_id', 'tile', 'facing', 'category', 'height', 'stuff', 'seconds_to_expiration',
+                 'usage_policy', 'owner_id', 'owner')
+
     def __init__(self, packet: HPacket):
         self.id, self.type_id, x, y, facing_id, z = packet.read('iiiiis')
         self.tile = HPoint(x, y, float(z))
@@ -384,6 +569,8 @@ class HUserProfile:
 
 
 class HWallItem:
+    __slots__ = ('id', 'type_id', 'location', 'state', 'seconds_to_expiration', 'usage_policy', 'owner_id', 'owner')
+
     def __init__(self, packet: HPacket):
         self.id, self.type_id, self.location, self.state, self.seconds_to_expiration, self.usage_policy, \
             self.owner_id = packet.read('sissiii')
@@ -424,8 +611,12 @@ class HWallUpdate:
 
 
 class HInventoryItem:
+    __slots__ = ('item_id', 'is_floor_furni', 'id', 'type_id', 'special_type', 'category', 'stuff', 'is_recyclable',
+                 'is_tradeable', 'is_groupable', 'market_place_allowed', 'seconds_to_expiration',
+                 'has_rent_period_started', 'room_Id', 'slot_id', 'extra')
+
     def __init__(self, packet: HPacket):
-        _, test = packet.read('is')
+        self.item_id, test = packet.read('is')  # inventory id, differs from id for gifts
         self.is_floor_furni = (test == 'S')
 
         self.id, self.type_id, special_type_id, self.category = packet.read('iiii')
@@ -502,14 +693,14 @@ class HHeightMap:
     def __init__(self, packet: HPacket):
         self.width, tileCount = packet.read('ii')
         self.height = int(tileCount / self.width)
-        self.tiles = [packet.read_short() for _ in range(tileCount)]
+        self.tiles = list(struct.unpack_from('>{}h'.format(tileCount), packet.buffer(), packet.read_index))
+        packet.read_index += 2 * tileCount
 
     def coords_to_index(self, x: int, y: int) -> int:
         return int(y * self.width + x)
 
     def index_to_coords(self, index: int) -> (int, int):
-        y = int(index % self.width)
-        x = int((index - y) / self.width)
+        y, x = divmod(index, self.width)
         return x, y
 
     def get_tile_value(self, x: int, y: int) -> int:
@@ -549,4 +740,16 @@ class HHeightMap:
         }
 
     def get_tiles(self) -> list[HHeightMapTile]:
-        return [self.get_tile(*self.index_to_coords(index)) for index in range(len(self.tiles))]
+        # every index is a valid tile, so the checks of the get_tile helpers can be skipped
+        tiles = []
+        for index, value in enumerate(self.tiles):
+            y, x = divmod(index, self.width)
+            tiles.append({
+                'x': x,
+                'y': y,
+                'tile_value': value,
+                'is_room_tile': value >= 0,
+                'tile_height': (value & 16383) / 256 if value >= 0 else -1,
+                'is_stacking_blocked': (value & 16384) > 0
+            })
+        return tiles
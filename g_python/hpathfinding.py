@@ -0,0 +1,331 @@
+import heapq
+from collections import OrderedDict, deque
+from typing import Iterable
+
+from .hparsers import HFloorItem, HUserUpdate, HEntity, HPoint, HDirection, NO_TILE
+
+MAX_STEP_HEIGHT: float = 1.1
+DEFAULT_CACHE_SIZE: int = 64
+UNREACHABLE: int = -1
+
+ORTHOGONAL = ((0, -1), (1, 0), (0, 1), (-1, 0))
+DIAGONAL = ((1, -1), (1, 1), (-1, 1), (-1, -1))
+
+
+class PathFinder:
+    """
+    Walkability grid of a room, built from its height map, floor furni and the positions of its users.
+    Furni and users are applied incrementally: only the tiles they cover are recomputed, and only the cached distance
+    fields that could have reached those tiles are dropped.
+
+    Moves follow the client's rules: one step to any of the 8 neighbours, a step up can be at most max_step_height
+    high (a step down can be any height), and a diagonal step can't squeeze between two blocked tiles.
+    """
+
+    def __init__(self, height_map, footprints: dict[int, tuple[int, int]] | None = None,
+                 walkable_types: Iterable[int] = (), max_step_height: float = MAX_STEP_HEIGHT,
+                 allow_diagonal: bool = True, cache_size: int = DEFAULT_CACHE_SIZE):
+        """
+        :param height_map: HHeightMap or HHeightMapArray of the room
+        :param footprints: width and length per furni type id, furni without a footprint cover a single tile
+        :param walkable_types: type ids of furni that can be walked on (rugs, gates that are open, ...)
+        """
+        self.width = height_map.width
+        self.height = height_map.height
+        self.footprints = {} if footprints is None else footprints
+        self.walkable_types = set(walkable_types)
+        self.max_step_height = max_step_height
+        self.__moves = ORTHOGONAL + DIAGONAL if allow_diagonal else ORTHOGONAL
+        self.__cache_size = cache_size
+
+        size = self.width * self.height
+        self.__base_heights = [float(height_map.get_tile_height(x, y)) if height_map.is_room_tile(x, y) else None
+                               for y in range(self.height) for x in range(self.width)]
+        self.__heights = list(self.__base_heights)
+        self.__furni_blocked = [False] * size
+
+        self.__furni = {}  # furni id -> (furni, tile indexes)
+        self.__furni_on_tile = [[] for _ in range(size)]
+        self.__users = {}  # user index -> tile indexes
+        self.__user_count = [0] * size
+
+        self.__fields = OrderedDict()  # goal tile index -> distance per tile index
+
+        self.__adjacent = [None] * size  # see __adjacent_tiles
+
+    def __index(self, x: int, y: int) -> int | None:
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return y * self.width + x
+        return None
+
+    def __adjacent_tiles(self, index: int) -> tuple[tuple[int, tuple[int, int] | None], ...]:
+        """
+        :return: the room tiles around the tile, with the two tiles a diagonal step passes between (None for other
+                 steps). Computed once per tile, the first time it's needed
+        """
+        adjacent = self.__adjacent[index]
+        if adjacent is not None:
+            return adjacent
+
+        width, heights = self.width, self.__base_heights
+        y, x = divmod(index, width)
+        adjacent = []
+        for (dx, dy) in self.__moves:
+            if not (0 <= x + dx < width and 0 <= y + dy < self.height):
+                continue
+            neighbour = index + dy * width + dx
+            if heights[neighbour] is not None:
+                adjacent.append((neighbour, (index + dx, index + dy * width) if dx != 0 and dy != 0 else None))
+
+        self.__adjacent[index] = adjacent = tuple(adjacent)
+        return adjacent
+
+    def __footprint(self, furni: HFloorItem) -> list[int]:
+        width, length = self.footprints.get(furni.type_id, (1, 1))
+        if furni.facing in (HDirection.EAST, HDirection.WEST):
+            width, length = length, width
+
+        indexes = [self.__index(furni.tile.x + dx, furni.tile.y + dy) for dy in range(length) for dx in range(width)]
+        return [index for index in indexes if index is not None]
+
+    def __refresh_tile(self, index: int) -> bool:
+        """
+        :return: whether the height or walkability of the tile changed
+        """
+        base = self.__base_heights[index]
+        if base is None:
+            return False
+
+        height = base
+        blocked = False
+        for furni in self.__furni_on_tile[index]:
+            height = max(height, furni.tile.z + furni.height)
+            blocked = blocked or furni.type_id not in self.walkable_types
+
+        if height == self.__heights[index] and blocked == self.__furni_blocked[index]:
+            return False
+        self.__heights[index] = height
+        self.__furni_blocked[index] = blocked
+        return True
+
+    def __invalidate(self, changed: list[int]) -> None:
+        """
+        Drops the cached fields that could have reached one of the changed tiles, in a single pass over the cache
+        """
+        if len(self.__fields) == 0 or len(changed) == 0:
+            return
+
+        nearby = set(changed)
+        for index in changed:
+            nearby.update(neighbour for (neighbour, _) in self.__adjacent_tiles(index))
+        # a field of a goal that can't be walked on reaches nothing, it only changes when the goal itself does
+        for goal in [goal for goal, field in self.__fields.items()
+                     if goal in nearby or any(field[i] != UNREACHABLE for i in nearby)]:
+            del self.__fields[goal]
+
+    def __set_occupied(self, indexes: list[int], amount: int) -> list[int]:
+        """
+        :return: the tiles that became free or taken, only those change walkability
+        """
+        changed = []
+        for index in indexes:
+            self.__user_count[index] += amount
+            if self.__user_count[index] == (1 if amount > 0 else 0):
+                changed.append(index)
+        return changed
+
+    # furni
+
+    def set_floor_furni(self, items: Iterable[HFloorItem]) -> None:
+        for furni_id in list(self.__furni):
+            self.remove_furni(furni_id)
+        for furni in items:
+            self.add_furni(furni)
+
+    def add_furni(self, furni: HFloorItem) -> None:
+        """
+        Adds a floor item, or moves it if an item with the same id was added before
+        """
+        changed = self.__remove_furni(furni.id)
+        indexes = self.__footprint(furni)
+        self.__furni[furni.id] = (furni, indexes)
+        for index in indexes:
+            self.__furni_on_tile[index].append(furni)
+            if self.__refresh_tile(index):
+                changed.append(index)
+        self.__invalidate(changed)
+
+    def remove_furni(self, furni_id: int) -> None:
+        self.__invalidate(self.__remove_furni(furni_id))
+
+    def __remove_furni(self, furni_id: int) -> list[int]:
+        if furni_id not in self.__furni:
+            return []
+
+        furni, indexes = self.__furni.pop(furni_id)
+        for index in indexes:
+            self.__furni_on_tile[index].remove(furni)
+        return [index for index in indexes if self.__refresh_tile(index)]
+
+    # users
+
+    def set_user(self, index: int, tile: HPoint, next_tile: HPoint | None = None) -> None:
+        """
+        Places a user on a tile, a walking user also occupies the tile it is moving to
+        """
+        tiles = [tile] if next_tile is None or next_tile == NO_TILE else [tile, next_tile]
+        indexes = [i for i in (self.__index(t.x, t.y) for t in tiles) if i is not None]
+        if self.__users.get(index) == indexes:
+            return
+
+        changed = self.__set_occupied(self.__users.pop(index, []), -1)
+        self.__users[index] = indexes
+        self.__invalidate(changed + self.__set_occupied(indexes, 1))
+
+    def remove_user(self, index: int) -> None:
+        if index in self.__users:
+            self.__invalidate(self.__set_occupied(self.__users.pop(index), -1))
+
+    def set_users(self, entities: Iterable[HEntity]) -> None:
+        for index in list(self.__users):
+            self.remove_user(index)
+        for entity in entities:
+            self.set_user(entity.index, entity.tile, entity.nextTile)
+
+    def update_users(self, updates: Iterable[HUserUpdate]) -> None:
+        for update in updates:
+            self.set_user(update.index, update.tile, update.nextTile)
+
+    # queries
+
+    def tile_height(self, x: int, y: int) -> float:
+        """
+        :return: height of the top of the tile, -1 if it isn't a room tile
+        """
+        index = self.__index(x, y)
+        if index is None or self.__heights[index] is None:
+            return -1
+        return self.__heights[index]
+
+    def is_walkable(self, x: int, y: int) -> bool:
+        index = self.__index(x, y)
+        return index is not None and self.__is_walkable(index)
+
+    def __is_walkable(self, index: int) -> bool:
+        return self.__heights[index] is not None and not self.__furni_blocked[index] and self.__user_count[index] == 0
+
+    def __neighbours(self, index: int) -> list[int]:
+        """
+        :return: every room tile that is a move away from the tile, ignoring step heights and what's on the tile
+        """
+        is_walkable = self.__is_walkable
+        return [neighbour for (neighbour, corners) in self.__adjacent_tiles(index)
+                if corners is None or is_walkable(corners[0]) or is_walkable(corners[1])]
+
+    def __can_step(self, source: int, target: int) -> bool:
+        return self.__heights[target] - self.__heights[source] <= self.max_step_height
+
+    def distance_field(self, goal: tuple[int, int]) -> list[int]:
+        """
+        Number of steps from every tile to the goal, cached until a change in the room could affect it.
+        Building a field visits the whole room, which costs a bit more than a single find_path: it pays off once a few
+        queries share the field between changes
+        :return: distance per tile index (y * width + x), UNREACHABLE for tiles that can't reach the goal
+        """
+        goal_index = self.__index(*goal)
+        if goal_index is None:
+            raise Exception('Goal {} is outside of the room'.format(goal))
+
+        if goal_index in self.__fields:
+            self.__fields.move_to_end(goal_index)
+            return self.__fields[goal_index]
+
+        field = [UNREACHABLE] * (self.width * self.height)
+        if self.__is_walkable(goal_index):
+            field[goal_index] = 0
+            queue = deque([goal_index])
+            while queue:
+                index = queue.popleft()
+                for neighbour in self.__neighbours(index):
+                    # walking back from the goal, so the step goes from the neighbour to this tile
+                    if field[neighbour] == UNREACHABLE and self.__can_step(neighbour, index):
+                        field[neighbour] = field[index] + 1
+                        # tiles that can't be walked on can still start a path (e.g. the tile of the bot itself)
+                        if self.__is_walkable(neighbour):
+                            queue.append(neighbour)
+
+        self.__fields[goal_index] = field
+        if len(self.__fields) > self.__cache_size:
+            self.__fields.popitem(last=False)
+        return field
+
+    def next_step(self, start: tuple[int, int], goal: tuple[int, int]) -> HPoint | None:
+        """
+        First step of a shortest path, using the cached distance field of the goal
+        :return: None if the goal can't be reached or the start is the goal
+        """
+        field = self.distance_field(goal)
+        goal_index = self.__index(*goal)
+        start_index = self.__index(*start)
+        if start_index is None or field[start_index] in (UNREACHABLE, 0):
+            return None
+
+        for neighbour in self.__neighbours(start_index):
+            # blocked tiles next to the path have a distance too, but they can't be walked through
+            if field[neighbour] == field[start_index] - 1 and self.__can_step(start_index, neighbour) \
+                    and (self.__is_walkable(neighbour) or neighbour == goal_index):
+                y, x = divmod(neighbour, self.width)
+                return HPoint(x, y, self.__heights[neighbour])
+        return None
+
+    def find_path(self, start: tuple[int, int], goal: tuple[int, int]) -> list[HPoint] | None:
+        """
+        A* search for a single path, without building a distance field
+        :return: the tiles to walk over, excluding the start and including the goal. None if the goal can't be reached
+        """
+        start_index = self.__index(*start)
+        goal_index = self.__index(*goal)
+        if start_index is None or goal_index is None or self.__heights[start_index] is None:
+            return None
+        if start_index == goal_index:
+            return []
+        if not self.__is_walkable(goal_index):
+            return None
+
+        goal_y, goal_x = divmod(goal_index, self.width)
+        diagonal = len(self.__moves) > 4
+
+        def estimate(index: int) -> int:
+            y, x = divmod(index, self.width)
+            if diagonal:
+                return max(abs(x - goal_x), abs(y - goal_y))
+            return abs(x - goal_x) + abs(y - goal_y)
+
+        came_from = {start_index: None}
+        steps = {start_index: 0}
+        queue = [(estimate(start_index), 0, start_index)]
+        while queue:
+            _, distance, index = heapq.heappop(queue)
+            if index == goal_index:
+                break
+            if distance > steps[index]:
+                continue
+
+            for neighbour in self.__neighbours(index):
+                if not self.__is_walkable(neighbour) or not self.__can_step(index, neighbour):
+                    continue
+                if neighbour not in steps or distance + 1 < steps[neighbour]:
+                    steps[neighbour] = distance + 1
+                    came_from[neighbour] = index
+                    heapq.heappush(queue, (distance + 1 + estimate(neighbour), distance + 1, neighbour))
+        else:
+            return None
+
+        path = []
+        index = goal_index
+        while index != start_index:
+            y, x = divmod(index, self.width)
+            path.append(HPoint(x, y, self.__heights[index]))
+            index = came_from[index]
+        path.reverse()
+        return path
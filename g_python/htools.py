@@ -1,13 +1,21 @@
-from typing import Callable
+import heapq
+import inspect
+from typing import Any, Callable, Hashable, Iterator
 
 from .gextension import Extension, ConsoleColour
 from .hmessage import HMessage, Direction
 from .hpacket import HPacket
-from .hparsers import HEntity, HFloorItem, HWallItem, HInventoryItem, HUserUpdate
+from .hparsers import HEntity, HFloorItem, HWallItem, HInventoryItem, HUserUpdate, read_stuff
 import sys
 
+BUCKET_SHIFT = 4  # users are also kept in buckets of 16x16 tiles, to find them by area
+
 
 def validate_headers(ext: Extension, parser_name: str, headers: list[tuple[int | str, Direction]]):
+    if inspect.iscoroutinefunction(ext.send_to_server):
+        raise Exception("'{}' requires an Extension, its requests can't be awaited on an AsyncExtension"
+                        .format(parser_name))
+
     def validate():
         for (header, direction) in headers:
             if header is None:
@@ -35,6 +43,8 @@ class RoomUsers:
             (request, Direction.TO_SERVER)])
 
         self.room_users = {}
+        self.__tiles = {}  # (x, y) -> {index: entity}, only entities with a tile
+        self.__buckets = {}  # (x >> BUCKET_SHIFT, y >> BUCKET_SHIFT) -> {index: (x, y, entity)}
         self.__callback_new_users = None
         self.__callback_remove_user = None
 
@@ -46,24 +56,42 @@ class RoomUsers:
         ext.intercept(Direction.TO_CLIENT, self.__remove_user, remove_user)
         ext.intercept(Direction.TO_CLIENT, self.__on_status, status)
 
+    def __place(self, entity: HEntity) -> None:
+        x, y = entity.tile.x, entity.tile.y
+        self.__tiles.setdefault((x, y), {})[entity.index] = entity
+        self.__buckets.setdefault((x >> BUCKET_SHIFT, y >> BUCKET_SHIFT), {})[entity.index] = (x, y, entity)
+
+    def __unplace(self, entity: HEntity) -> None:
+        x, y = entity.tile.x, entity.tile.y
+        for (index, key) in ((self.__tiles, (x, y)), (self.__buckets, (x >> BUCKET_SHIFT, y >> BUCKET_SHIFT))):
+            entities = index.get(key)
+            if entities is not None and entities.pop(entity.index, None) is not None and len(entities) == 0:
+                del index[key]
+
     def __remove_user(self, message: HMessage) -> None:
         index = int(message.packet.read_string())
         if index in self.room_users:
             user = self.room_users[index]
             del self.room_users[index]
+            self.__unplace(user)
             if self.__callback_remove_user is not None:
                 self.__callback_remove_user(user)
 
     def __load_room_users(self, message: HMessage) -> None:
         users = HEntity.parse(message.packet)
         for user in users:
+            if user.index in self.room_users:
+                self.__unplace(self.room_users[user.index])
             self.room_users[user.index] = user
+            self.__place(user)
 
         if self.__callback_new_users is not None:
             self.__callback_new_users(users)
 
     def __clear_room_users(self, _) -> None:
         self.room_users.clear()
+        self.__tiles.clear()
+        self.__buckets.clear()
 
     def on_new_users(self, func: Callable[[list[HEntity]], None]) -> None:
         self.__callback_new_users = func
@@ -72,50 +100,291 @@ class RoomUsers:
         self.__callback_remove_user = func
 
     def __on_status(self, message: HMessage) -> None:
-        self.try_updates(HUserUpdate.parse(message.packet))
+        self.apply_updates(HUserUpdate.parse(message.packet))
 
     def try_updates(self, updates: list[HUserUpdate]) -> None:
+        self.apply_updates(updates)
+
+    def apply_updates(self, updates: list[HUserUpdate]) -> None:
+        """
+        Applies a whole status packet, moving the users in the tile index along
+        """
+        room_users = self.room_users
         for update in updates:
-            try:
-                user = self.room_users[update.index]
-                if isinstance(user, HEntity):
-                    user.try_update(update)
-            except KeyError:
-                pass
+            user = room_users.get(update.index)
+            if user is None:
+                continue
+
+            if user.tile.x != update.tile.x or user.tile.y != update.tile.y:
+                self.__unplace(user)
+                user.try_update(update)
+                self.__place(user)
+            else:
+                user.try_update(update)
+
+    def users_on_tile(self, x: int, y: int) -> list[HEntity]:
+        return list(self.__tiles.get((x, y), {}).values())
+
+    def users_in_area(self, x1: int, y1: int, x2: int, y2: int) -> list[HEntity]:
+        """
+        :return: the users within the rectangle, both corners included
+        """
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        found = []
+        # only the users in the buckets that overlap the area are checked
+        for bucket_y in range(y1 >> BUCKET_SHIFT, (y2 >> BUCKET_SHIFT) + 1):
+            for bucket_x in range(x1 >> BUCKET_SHIFT, (x2 >> BUCKET_SHIFT) + 1):
+                bucket = self.__buckets.get((bucket_x, bucket_y))
+                if bucket is not None:
+                    found.extend(user for (x, y, user) in bucket.values() if x1 <= x <= x2 and y1 <= y <= y2)
+        return found
+
+    def users_within(self, x: int, y: int, radius: int) -> list[HEntity]:
+        """
+        :return: the users at most radius steps away from the tile
+        """
+        return self.users_in_area(x - radius, y - radius, x + radius, y + radius)
+
+    def nearest_users(self, x: int, y: int, count: int = 1) -> list[HEntity]:
+        """
+        :return: the count users with the fewest steps away from the tile, nearest first
+        """
+        found = []
+        radius = 0
+        # search ring by ring around the tile, as long as the rings are smaller than the set of occupied tiles
+        while (2 * radius + 1) ** 2 <= len(self.__tiles):
+            if radius == 0:
+                ring = [(x, y)]
+            else:
+                ring = [(x + dx, y + dy) for dx in range(-radius, radius + 1) for dy in (-radius, radius)] + \
+                       [(x + dx, y + dy) for dx in (-radius, radius) for dy in range(-radius + 1, radius)]
+            for tile in ring:
+                on_tile = self.__tiles.get(tile)
+                if on_tile is not None:
+                    found.extend(on_tile.values())
+            if len(found) >= count:
+                return found[:count]
+            radius += 1
+
+        tiles = heapq.nsmallest(count, self.__tiles.items(),
+                                key=lambda item: max(abs(item[0][0] - x), abs(item[0][1] - y)))
+        return [user for _, on_tile in tiles for user in on_tile.values()][:count]
 
     def request(self) -> None:
         self.room_users = {}
+        self.__tiles.clear()
+        self.__buckets.clear()
         self.__ext.send_to_server(HPacket(self.__request_id))
 
 
+class ItemStore:
+    """
+    Items by id, with indexes that are kept up to date as items are added, replaced or removed.
+    Every index maps a key (computed from an item by the function the index is created with) to the items with that key.
+    """
+
+    def __init__(self, indexes: dict[str, Callable[[Any], Hashable]],
+                 identify: Callable[[Any], Hashable] = lambda item: item.id):
+        """
+        :param identify: returns the id the store keeps an item by
+        """
+        self.items = {}
+        self.__identify = identify
+        self.__keys = indexes
+        self.__indexes = {name: {} for name in indexes}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator:
+        return iter(self.items.values())
+
+    def __contains__(self, item_id) -> bool:
+        return item_id in self.items
+
+    def get(self, item_id) -> Any | None:
+        return self.items.get(item_id)
+
+    def add(self, item) -> None:
+        """
+        Adds an item, replacing the item with the same id
+        """
+        item_id = self.__identify(item)
+        self.remove(item_id)
+        self.items[item_id] = item
+        for name, key in self.__keys.items():
+            self.__indexes[name].setdefault(key(item), {})[item_id] = item
+
+    def remove(self, item_id) -> Any | None:
+        """
+        :return: the removed item, None if there was no item with the id
+        """
+        item = self.items.pop(item_id, None)
+        if item is not None:
+            for name, key in self.__keys.items():
+                index = self.__indexes[name]
+                items = index[key(item)]
+                del items[item_id]
+                if len(items) == 0:
+                    del index[key(item)]
+        return item
+
+    def clear(self) -> None:
+        self.items.clear()
+        for index in self.__indexes.values():
+            index.clear()
+
+    def lookup(self, index: str, key: Hashable) -> list:
+        return list(self.__indexes[index].get(key, {}).values())
+
+
 class RoomFurni:
     def __init__(self, ext: Extension, floor_items: str | int = 'Objects', wall_items: str | int = 'Items',
-                 request: str | int = 'GetHeightMap'):
+                 request: str | int = 'GetHeightMap',
+                 floor_item_add: str | int = 'ObjectAdd', floor_item_remove: str | int = 'ObjectRemove',
+                 floor_item_update: str | int = 'ObjectUpdate', floor_item_data_update: str | int = 'ObjectDataUpdate',
+                 wall_item_add: str | int = 'ItemAdd', wall_item_remove: str | int = 'ItemRemove',
+                 wall_item_update: str | int = 'ItemUpdate'):
         validate_headers(ext, 'RoomFurni', [
             (floor_items, Direction.TO_CLIENT),
             (wall_items, Direction.TO_CLIENT),
-            (request, Direction.TO_SERVER)])
-
-        self.floor_furni = []
-        self.wall_furni = []
+            (request, Direction.TO_SERVER),
+            (floor_item_add, Direction.TO_CLIENT),
+            (floor_item_remove, Direction.TO_CLIENT),
+            (floor_item_update, Direction.TO_CLIENT),
+            (floor_item_data_update, Direction.TO_CLIENT),
+            (wall_item_add, Direction.TO_CLIENT),
+            (wall_item_remove, Direction.TO_CLIENT),
+            (wall_item_update, Direction.TO_CLIENT)])
+
+        self.floor_items = ItemStore({
+            'tile': lambda furni: (furni.tile.x, furni.tile.y),
+            'type_id': lambda furni: furni.type_id,
+            'owner_id': lambda furni: furni.owner_id
+        })
+        self.wall_items = ItemStore({
+            'type_id': lambda furni: furni.type_id,
+            'owner_id': lambda furni: furni.owner_id
+        })
+        self.__owners = {}
         self.__callback_floor_furni = None
         self.__callback_wall_furni = None
+        self.__callback_furni_added = None
+        self.__callback_furni_removed = None
+        self.__callback_furni_updated = None
 
         self.__ext = ext
         self.__request_id = request
 
         ext.intercept(Direction.TO_CLIENT, self.__floor_furni_load, floor_items)
         ext.intercept(Direction.TO_CLIENT, self.__wall_furni_load, wall_items)
+        ext.intercept(Direction.TO_CLIENT, self.__floor_furni_add, floor_item_add)
+        ext.intercept(Direction.TO_CLIENT, self.__floor_furni_remove, floor_item_remove)
+        ext.intercept(Direction.TO_CLIENT, self.__floor_furni_update, floor_item_update)
+        ext.intercept(Direction.TO_CLIENT, self.__floor_furni_data_update, floor_item_data_update)
+        ext.intercept(Direction.TO_CLIENT, self.__wall_furni_add, wall_item_add)
+        ext.intercept(Direction.TO_CLIENT, self.__wall_furni_remove, wall_item_remove)
+        ext.intercept(Direction.TO_CLIENT, self.__wall_furni_update, wall_item_update)
+
+    @property
+    def floor_furni(self) -> list[HFloorItem]:
+        return list(self.floor_items)
+
+    @floor_furni.setter
+    def floor_furni(self, items: list[HFloorItem]) -> None:
+        self.__fill(self.floor_items, items)
+
+    @property
+    def wall_furni(self) -> list[HWallItem]:
+        return list(self.wall_items)
+
+    @wall_furni.setter
+    def wall_furni(self, items: list[HWallItem]) -> None:
+        self.__fill(self.wall_items, items)
+
+    def __fill(self, store: ItemStore, items: list) -> None:
+        store.clear()
+        for furni in items:
+            self.__owners[furni.owner_id] = furni.owner
+            store.add(furni)
+
+    def __load(self, store: ItemStore, items: list, callback: Callable | None) -> None:
+        self.__fill(store, items)
+        if callback is not None:
+            callback(items)
 
     def __floor_furni_load(self, message: HMessage) -> None:
-        self.floor_furni = HFloorItem.parse(message.packet)
-        if self.__callback_floor_furni is not None:
-            self.__callback_floor_furni(self.floor_furni)
+        self.__load(self.floor_items, HFloorItem.parse(message.packet), self.__callback_floor_furni)
 
     def __wall_furni_load(self, message: HMessage) -> None:
-        self.wall_furni = HWallItem.parse(message.packet)
-        if self.__callback_wall_furni is not None:
-            self.__callback_wall_furni(self.wall_furni)
+        self.__load(self.wall_items, HWallItem.parse(message.packet), self.__callback_wall_furni)
+
+    def __add(self, store: ItemStore, furni, owner: str | None = None) -> None:
+        if owner is not None:
+            self.__owners[furni.owner_id] = owner
+        furni.owner = self.__owners.get(furni.owner_id)
+
+        updated = furni.id in store
+        store.add(furni)
+        callback = self.__callback_furni_updated if updated else self.__callback_furni_added
+        if callback is not None:
+            callback(furni)
+
+    def __remove(self, store: ItemStore, furni_id: int | str) -> None:
+        furni = store.remove(furni_id)
+        if furni is not None and self.__callback_furni_removed is not None:
+            self.__callback_furni_removed(furni)
+
+    def __floor_furni_add(self, message: HMessage) -> None:
+        furni = HFloorItem(message.packet)
+        self.__add(self.floor_items, furni, message.packet.read_string())
+
+    def __floor_furni_remove(self, message: HMessage) -> None:
+        self.__remove(self.floor_items, int(message.packet.read_string()))
+
+    def __floor_furni_update(self, message: HMessage) -> None:
+        self.__add(self.floor_items, HFloorItem(message.packet))
+
+    def __floor_furni_data_update(self, message: HMessage) -> None:
+        packet = message.packet
+        furni = self.floor_items.get(int(packet.read_string()))
+        if furni is None:
+            return
+
+        # stuff isn't indexed, so the item can be changed in place
+        furni.category = packet.read_int()
+        furni.stuff = read_stuff(packet, furni.category)
+        if self.__callback_furni_updated is not None:
+            self.__callback_furni_updated(furni)
+
+    def __wall_furni_add(self, message: HMessage) -> None:
+        furni = HWallItem(message.packet)
+        self.__add(self.wall_items, furni, message.packet.read_string())
+
+    def __wall_furni_remove(self, message: HMessage) -> None:
+        self.__remove(self.wall_items, message.packet.read_string())
+
+    def __wall_furni_update(self, message: HMessage) -> None:
+        self.__add(self.wall_items, HWallItem(message.packet))
+
+    def furni_on_tile(self, x: int, y: int) -> list[HFloorItem]:
+        """
+        :return: the floor items placed on the tile, items with a bigger footprint are indexed by their origin tile
+        """
+        return self.floor_items.lookup('tile', (x, y))
+
+    def floor_furni_by_type(self, type_id: int) -> list[HFloorItem]:
+        return self.floor_items.lookup('type_id', type_id)
+
+    def floor_furni_by_owner(self, owner_id: int) -> list[HFloorItem]:
+        return self.floor_items.lookup('owner_id', owner_id)
+
+    def wall_furni_by_type(self, type_id: int) -> list[HWallItem]:
+        return self.wall_items.lookup('type_id', type_id)
+
+    def wall_furni_by_owner(self, owner_id: int) -> list[HWallItem]:
+        return self.wall_items.lookup('owner_id', owner_id)
 
     def on_floor_furni_load(self, callback: Callable[[list[HFloorItem]], None]) -> None:
         self.__callback_floor_furni = callback
@@ -123,29 +392,76 @@ class RoomFurni:
     def on_wall_furni_load(self, callback: Callable[[list[HWallItem]], None]) -> None:
         self.__callback_wall_furni = callback
 
+    def on_furni_added(self, callback: Callable[[HFloorItem | HWallItem], None]) -> None:
+        self.__callback_furni_added = callback
+
+    def on_furni_removed(self, callback: Callable[[HFloorItem | HWallItem], None]) -> None:
+        self.__callback_furni_removed = callback
+
+    def on_furni_updated(self, callback: Callable[[HFloorItem | HWallItem], None]) -> None:
+        """
+        Called for moved items as well as items with a new state
+        """
+        self.__callback_furni_updated = callback
+
     def request(self) -> None:
-        self.floor_furni = []
-        self.wall_furni = []
+        self.floor_items.clear()
+        self.wall_items.clear()
         self.__ext.send_to_server(HPacket(self.__request_id))
 
 
 class Inventory:
     def __init__(self, ext: Extension, inventory_items: str | int = 'FurniList',
-                 request: str | int = 'RequestFurniInventory'):
+                 request: str | int = 'RequestFurniInventory', item_add_or_update: str | int = 'FurniListAddOrUpdate',
+                 item_remove: str | int = 'FurniListRemove', invalidate: str | int = 'FurniListInvalidate'):
         validate_headers(ext, 'Inventory', [
             (inventory_items, Direction.TO_CLIENT),
-            (request, Direction.TO_SERVER)])
+            (request, Direction.TO_SERVER),
+            (item_add_or_update, Direction.TO_CLIENT),
+            (item_remove, Direction.TO_CLIENT),
+            (invalidate, Direction.TO_CLIENT)])
 
         self.loaded = False
         self.is_loading = False
-        self.inventory_items = []
-        self.__inventory_items_buffer = []
+        self.is_invalidated = False  # the server changed the inventory in a way that needs a full reload
+        self.items = self.__new_store()
+        self.__loading_items = None  # the inventory that is being (re)loaded
 
         self.__ext = ext
         self.__request_id = request
         self.__inventory_load_callback = None
+        self.__fragment_callback = None
+        self.__callback_item_added = None
+        self.__callback_item_removed = None
+        self.__callback_item_updated = None
+        self.__invalidated_callback = None
 
         ext.intercept(Direction.TO_CLIENT, self.__user_inventory_load, inventory_items)
+        ext.intercept(Direction.TO_CLIENT, self.__item_add_or_update, item_add_or_update)
+        ext.intercept(Direction.TO_CLIENT, self.__item_remove, item_remove)
+        ext.intercept(Direction.TO_CLIENT, self.__invalidate, invalidate)
+
+    def __new_store(self) -> ItemStore:
+        return ItemStore({
+            'id': lambda item: item.id,
+            'type_id': lambda item: item.type_id,
+            'category': lambda item: item.category
+        }, lambda item: item.item_id)
+
+    @property
+    def inventory_items(self) -> list[HInventoryItem]:
+        return list(self.items)
+
+    @inventory_items.setter
+    def inventory_items(self, items: list[HInventoryItem]) -> None:
+        self.items.clear()
+        for item in items:
+            self.items.add(item)
+
+    def __stores(self) -> list[ItemStore]:
+        if self.__loading_items is None or self.__loading_items is self.items:
+            return [self.items]
+        return [self.items, self.__loading_items]
 
     def __user_inventory_load(self, message: HMessage) -> None:
         packet = message.packet
@@ -155,22 +471,85 @@ class Inventory:
         items = HInventoryItem.parse(packet)
 
         if current == 0:  # fresh inventory load
-            self.__inventory_items_buffer.clear()
+            # a reload is built next to the loaded inventory, which stays complete until the reload is done. The
+            # first load has nothing to keep, its fragments can be used right away
+            self.__loading_items = self.__new_store()
+            if not self.loaded:
+                self.items = self.__loading_items
             self.is_loading = True
+            self.is_invalidated = False
 
-        self.__inventory_items_buffer.extend(items)
-        # print("Loading inventory.. ({}/{})".format(current + 1, total))
+        loading_items = self.items if self.__loading_items is None else self.__loading_items
+        for item in items:
+            loading_items.add(item)
+        if self.__fragment_callback is not None:
+            self.__fragment_callback(items, current, total)
 
         if current == total - 1:  # latest packet
+            self.items = loading_items
+            self.__loading_items = None
             self.is_loading = False
             self.loaded = True
-            self.inventory_items = list(self.__inventory_items_buffer)
-            self.__inventory_items_buffer.clear()
 
-            self.__inventory_load_callback(self.inventory_items)
+            if self.__inventory_load_callback is not None:
+                self.__inventory_load_callback(self.inventory_items)
+
+    def __item_add_or_update(self, message: HMessage) -> None:
+        item = HInventoryItem(message.packet)
+        updated = item.item_id in self.items
+        for store in self.__stores():
+            store.add(item)
+
+        callback = self.__callback_item_updated if updated else self.__callback_item_added
+        if callback is not None:
+            callback(item)
+
+    def __item_remove(self, message: HMessage) -> None:
+        item_id = message.packet.read_int()
+        item = None
+        for store in self.__stores():
+            item = store.remove(item_id) or item
+        if item is not None and self.__callback_item_removed is not None:
+            self.__callback_item_removed(item)
+
+    def __invalidate(self, _) -> None:
+        self.is_invalidated = True
+        if self.__invalidated_callback is not None:
+            self.__invalidated_callback()
+
+    def items_by_id(self, furni_id: int) -> list[HInventoryItem]:
+        return self.items.lookup('id', furni_id)
+
+    def items_by_type(self, type_id: int) -> list[HInventoryItem]:
+        return self.items.lookup('type_id', type_id)
+
+    def items_by_category(self, category: int) -> list[HInventoryItem]:
+        return self.items.lookup('category', category)
 
     def request(self) -> None:
         self.__ext.send_to_server(HPacket(self.__request_id))
 
     def on_inventory_load(self, callback: Callable[[list[HInventoryItem]], None]) -> None:
         self.__inventory_load_callback = callback
+
+    def on_inventory_fragment(self, callback: Callable[[list[HInventoryItem], int, int], None]) -> None:
+        """
+        :param callback: called with the items, index and total amount of every FurniList fragment as it arrives.
+                         During a reload, items keeps the previous inventory until the last fragment arrived
+        """
+        self.__fragment_callback = callback
+
+    def on_item_added(self, callback: Callable[[HInventoryItem], None]) -> None:
+        self.__callback_item_added = callback
+
+    def on_item_removed(self, callback: Callable[[HInventoryItem], None]) -> None:
+        self.__callback_item_removed = callback
+
+    def on_item_updated(self, callback: Callable[[HInventoryItem], None]) -> None:
+        self.__callback_item_updated = callback
+
+    def on_inventory_invalidated(self, callback: Callable[[], None]) -> None:
+        """
+        :param callback: called when the server asks for the inventory to be reloaded, for example with request()
+        """
+        self.__invalidated_callback = callback
@@ -19,4 +19,7 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     python_requires='>=3.5',
+    extras_require={
+        'numpy': ['numpy'],
+    },
 )
@@ -16,6 +16,8 @@ ext.start()
 inv = Inventory(ext)
 # inventory items will be available under:
 # inv.inventory_items           (list of HInventoryItem)
+# and can be looked up with inv.items_by_type(type_id), inv.items_by_category(category) and inv.items_by_id(id)
+# items that are added or removed after the inventory was loaded (e.g. by a trade) are kept up to date
 
 
 def request_inventory():
@@ -27,5 +29,12 @@ def on_inventory_load(items):
     print("Found {} items!".format(len(items)))
 
 
+def on_inventory_fragment(items, current, total):
+    print("Loading inventory.. ({}/{})".format(current + 1, total))
+
+
 ext.on_event('double_click', request_inventory)
 inv.on_inventory_load(on_inventory_load)
+inv.on_inventory_fragment(on_inventory_fragment)
+inv.on_item_added(lambda item: print("Item {} added".format(item.item_id)))
+inv.on_item_removed(lambda item: print("Item {} removed".format(item.item_id)))
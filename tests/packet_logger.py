@@ -16,8 +16,10 @@ ext.start()
 
 def all_packets(message):
     packet = message.packet
-    s = packet.g_string(ext)
-    expr = packet.g_expression(ext)
+    # both requests are in flight at the same time
+    s_future = ext.packet_to_string_async(packet)
+    expr_future = ext.packet_to_expression_async(packet, message.direction)
+    s, expr = s_future.result(), expr_future.result()
     print('{} --> {}'.format(message.direction.name, s))
     if expr != '':
         print(expr)
@@ -26,6 +26,11 @@ room_users.on_new_users(lambda users: print(list(map(str, users))))
 # room_furni.wall_furni         (list of HWallItem)
 # room_users.room_users         (list of HEntitity)
 
+# added, moved and removed furniture is kept up to date, and can be looked up without going over every item:
+# room_furni.furni_on_tile(x, y), room_furni.floor_furni_by_type(type_id), room_furni.floor_furni_by_owner(owner_id)
+room_furni.on_furni_added(lambda furni: print("Furni {} added".format(furni.id)))
+room_furni.on_furni_removed(lambda furni: print("Furni {} removed".format(furni.id)))
+
 # you can also request the users/furniture with the .request() method
 
 time.sleep(0.5)